@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from typing import Union, List
 
-from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.agents import AgentAction, AgentFinish
 from langchain_core.language_models import BaseLanguageModel
@@ -12,21 +12,44 @@ from langchain_core.runnables import chain, Runnable
 from langchain_core.tools import BaseTool
 
 from agents.tools.parsers import ReadingResult
+import settings
+from metrics import metrics
+from scheduler import TimedTask
 from utils import get_list, get_os_language
 
 logger = logging.getLogger(__name__)
 
+tool_executor = ThreadPoolExecutor(max_workers=settings.TOOL_WORKERS, thread_name_prefix='tool')
+
+
+def run_tool(tool: BaseTool, tool_input):
+    with metrics.span('tool', tool=tool.name):
+        return tool.run(tool_input)
+
 
 def tool_call(tool_map):
     @chain
     def fn(output: Union[List[AgentAction], AgentFinish]):
         if isinstance(output, AgentFinish):
             return
-        docs = []
+        # 同一轮的工具调用并发执行，单个工具失败或超时不影响其他结果；超时从工具开始执行时计算，不含排队时间
+        tasks = []
         for action in output:
             tool: BaseTool = tool_map[action.tool]
             logger.info(f"Using {action.tool} input:{action.tool_input}")
-            tool_output = tool.run(action.tool_input)
+            tasks.append((action, TimedTask(tool_executor, run_tool, tool, action.tool_input)))
+        docs = []
+        for action, task in tasks:
+            timeout = settings.TOOL_TIMEOUTS.get(action.tool, settings.TOOL_TIMEOUT)
+            try:
+                tool_output = task.result(timeout)
+            except TimeoutError:
+                metrics.incr('tool_timeouts', tool=action.tool)
+                logger.warning(f"Tool {action.tool} timeout after {timeout}s input:{action.tool_input}")
+                continue
+            except Exception as e:
+                logger.warning(f"Tool {action.tool} failed input:{action.tool_input} {e!r}")
+                continue
             if tool_output:
                 docs.extend(get_list(tool_output))
         return docs or None
@@ -34,6 +57,8 @@ def tool_call(tool_map):
 
 
 def create_searcher(system, tools, llm: BaseLanguageModel):
+    # langchain.agents会连带导入langchain.chains，推迟到创建searcher时
+    from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
     prompt = ChatPromptTemplate.from_messages([
         ("system", system + f'Please use {get_os_language()} language'),
         ("human", "{input}")
@@ -46,9 +71,10 @@ def create_searcher(system, tools, llm: BaseLanguageModel):
 def create_reader(system, llm: BaseLanguageModel, schema=ReadingResult):
     parser = JsonOutputParser(pydantic_object=schema)
     prompt = ChatPromptTemplate.from_messages([
-        ("system", system + f'Please use {get_os_language()} language'),
-        ("human", "{input}\n" + parser.get_format_instructions())
-    ])
+        # 格式说明含JSON花括号，作为变量传入避免被当作模板占位符；放在system中使human消息只含待读内容
+        ("system", system + f'Please use {get_os_language()} language' + '\n{format_instructions}'),
+        ("human", "{input}")
+    ]).partial(format_instructions=parser.get_format_instructions())
     agent = prompt | llm | parser
     return agent
 
@@ -1,15 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import List, TypedDict, Optional, Dict
-
-from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
-from langchain_community.utilities.bing_search import BingSearchAPIWrapper
-from langchain_community.utilities.duckduckgo_search import DuckDuckGoSearchAPIWrapper
-from langchain_community.utilities.brave_search import BraveSearchWrapper
-from langchain_community.utilities.searx_search import SearxSearchWrapper
-from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+import functools
+import importlib
+import logging
+from importlib.metadata import entry_points
+from typing import List, TypedDict, Optional, Dict, NamedTuple
 
 import settings
+from agents.tools.ratelimit import limited, CircuitOpen
+from cache import search_cache
+from metrics import metrics
+from utils import normalize_query
+
+logger = logging.getLogger(__name__)
 
 
 class SearchResult(TypedDict):
@@ -18,33 +21,89 @@ class SearchResult(TypedDict):
     summary: str
 
 
-class DuckDuckGoAPI(DuckDuckGoSearchAPIWrapper):
-    def _ddgs_text(
-        self, query: str, max_results: Optional[int] = None
-    ) -> List[Dict[str, str]]:
-        """Run query through DuckDuckGo text search and return results."""
-        from duckduckgo_search import DDGS
-
-        with DDGS(proxy=settings.TOOL_PROXY) as ddgs:
-            ddgs_gen = ddgs.text(
-                query,
-                region=self.region,
-                safesearch=self.safesearch,
-                timelimit=self.time,
-                max_results=max_results or self.max_results,
-                backend=self.backend,
-            )
-            if ddgs_gen:
-                return [r for r in ddgs_gen]
-        return []
-
-
-def search_adapter(cls, num_results, method='results', class_kwargs: Optional[dict] = None, **search_kwargs):
+def _duckduckgo_api():
+    from langchain_community.utilities.duckduckgo_search import DuckDuckGoSearchAPIWrapper
+
+    class DuckDuckGoAPI(DuckDuckGoSearchAPIWrapper):
+        def _ddgs_text(
+            self, query: str, max_results: Optional[int] = None
+        ) -> List[Dict[str, str]]:
+            """Run query through DuckDuckGo text search and return results."""
+            from duckduckgo_search import DDGS
+
+            with DDGS(proxy=settings.TOOL_PROXY) as ddgs:
+                ddgs_gen = ddgs.text(
+                    query,
+                    region=self.region,
+                    safesearch=self.safesearch,
+                    timelimit=self.time,
+                    max_results=max_results or self.max_results,
+                    backend=self.backend,
+                )
+                if ddgs_gen:
+                    return [r for r in ddgs_gen]
+            return []
+    return DuckDuckGoAPI
+
+
+class EngineSpec(NamedTuple):
+    """Where to find a search wrapper class; ``target`` is "module:attr" or a zero-arg factory."""
+    target: object
+    method: str = 'results'
+
+    def load(self) -> type:
+        if callable(self.target):
+            return self.target()
+        module, attr = self.target.split(':')
+        return getattr(importlib.import_module(module), attr)
+
+
+# 引擎类在首次使用时才导入，其余包可通过entry point注册新引擎
+ENTRY_POINT_GROUP = 'nextsearch.search_engines'
+SEARCH_ENGINES: Dict[str, EngineSpec] = {
+    'google': EngineSpec('langchain_community.utilities.google_search:GoogleSearchAPIWrapper'),
+    'bing': EngineSpec('langchain_community.utilities.bing_search:BingSearchAPIWrapper'),
+    'duckduckgo': EngineSpec(_duckduckgo_api),
+    'tavily': EngineSpec('langchain_community.utilities.tavily_search:TavilySearchAPIWrapper'),
+    'searx': EngineSpec('langchain_community.utilities.searx_search:SearxSearchWrapper'),
+    'brave': EngineSpec('langchain_community.utilities.brave_search:BraveSearchWrapper', '_search_request'),
+}
+
+
+def register_engine(name: str, target, method: str = 'results'):
+    SEARCH_ENGINES[name] = EngineSpec(target, method)
+
+
+def _engine_spec(name: str) -> EngineSpec:
+    if name not in SEARCH_ENGINES:
+        eps = entry_points()
+        # Python 3.10以前entry_points()返回dict
+        eps = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, 'select') else eps.get(ENTRY_POINT_GROUP, ())
+        for ep in eps:
+            if ep.name == name:
+                register_engine(name, ep.value)
+                break
+        else:
+            raise KeyError(f'Supported SearchEngine: {list(SEARCH_ENGINES)}')
+    return SEARCH_ENGINES[name]
+
+
+@functools.lru_cache(maxsize=None)
+def load_engine(name: str) -> type:
+    """Import and return the wrapper class of a registered engine, once per process."""
+    return _engine_spec(name).load()
+
+
+def search_adapter(name: str, num_results, class_kwargs: Optional[dict] = None, **search_kwargs):
     def search_wrap():
+        cls, method = load_engine(name), _engine_spec(name).method
         instance = cls(**(class_kwargs or {}))
 
-        def search(query):
-            items = getattr(instance, method)(query, num_results, **search_kwargs)
+        def _search(query):
+            def call():
+                with metrics.span('search_api', engine=cls.__name__):
+                    return getattr(instance, method)(query, num_results, **search_kwargs)
+            items = limited(cls.__name__, call)
             _results = []
             for item in items:
                 _res = SearchResult(
@@ -55,19 +114,42 @@ def search_adapter(cls, num_results, method='results', class_kwargs: Optional[di
                 assert _res['link']
                 _results.append(_res)
             return _results
+
+        def search(query):
+            key = (cls.__name__, normalize_query(query), num_results)
+            results = search_cache.get_or_call(key, lambda: _search(query))
+            return [SearchResult(**res) for res in results]
         return search
     return search_wrap
 
 
 def get_search_fn(name: str, num_results: int):
-    SEARCH_ENGINE_LOOKUP = {
-        'google': search_adapter(GoogleSearchAPIWrapper, num_results),
-        'bing': search_adapter(BingSearchAPIWrapper, num_results),
-        'duckduckgo': search_adapter(DuckDuckGoAPI, num_results),
-        'tavily': search_adapter(TavilySearchAPIWrapper, num_results),
-        'searx': search_adapter(SearxSearchWrapper, num_results),
-        'brave': search_adapter(BraveSearchWrapper, num_results, '_search_request'),
-    }
-    if name not in SEARCH_ENGINE_LOOKUP:
-        raise KeyError(f'Supported SearchEngine: {[SEARCH_ENGINE_LOOKUP.keys()]}')
-    return SEARCH_ENGINE_LOOKUP[name]
\ No newline at end of file
+    _engine_spec(name)
+    fallbacks = []
+    for fallback in settings.SEARCH_FALLBACK_ENGINES.get(name, []):
+        try:
+            _engine_spec(fallback)
+        except KeyError:
+            continue
+        fallbacks.append(fallback)
+    if not fallbacks:
+        return search_adapter(name, num_results)
+
+    def search_wrap():
+        engines = {name: search_adapter(name, num_results)()}
+
+        def search(query):
+            error = None
+            for engine_name in [name, *fallbacks]:
+                try:
+                    # 备用引擎在首次需要时才创建
+                    if engine_name not in engines:
+                        engines[engine_name] = search_adapter(engine_name, num_results)()
+                    return engines[engine_name](query)
+                except Exception as e:
+                    if not isinstance(e, CircuitOpen):
+                        logger.warning(f"Search engine {engine_name} failed: {e!r}")
+                    error = e
+            raise error
+        return search
+    return search_wrap
@@ -1,78 +1,309 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import List
+import functools
+import logging
+import multiprocessing
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Optional, Union, TYPE_CHECKING
+from urllib.parse import urlsplit
 
-import pypdf
+import charset_normalizer
 import requests
-from langchain_community.document_loaders.parsers.pdf import PyPDFParser
-from langchain_community.document_loaders.pdf import PyPDFLoader
-from langchain_core.document_loaders import Blob
-from newspaper import Article
+from requests.adapters import HTTPAdapter
 from pydantic import AnyUrl, BaseModel, Field
 
+import settings
+from agents.tools.ratelimit import host_limiters, retry, Throttled
+from cache import fetch_cache
 from documents import Metadata
-from lxml.html.clean import Cleaner
+from metrics import metrics
+from scheduler import TimedTask
 
-setattr(Article, 'release_resources', lambda *args, **kwargs: None)
+# newspaper、pypdf、lxml在首次使用时才导入
+if TYPE_CHECKING:
+    import pypdf
+    from lxml.html.clean import Cleaner
+
+logger = logging.getLogger(__name__)
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=settings.FETCH_POOL_SIZE, pool_maxsize=settings.FETCH_POOL_SIZE))
+session.mount('https://', HTTPAdapter(pool_connections=settings.FETCH_POOL_SIZE, pool_maxsize=settings.FETCH_POOL_SIZE))
+fetch_executor = ThreadPoolExecutor(max_workers=settings.FETCH_WORKERS, thread_name_prefix='fetch')
+_host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(host: str) -> threading.BoundedSemaphore:
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(settings.FETCH_MAX_PER_HOST)
+        return _host_semaphores[host]
+
+
+def fetch(url: str, **kwargs) -> requests.Response:
+    """GET through the shared session, limited to FETCH_MAX_PER_HOST concurrent requests and an adaptive
+    request rate per host; throttled or failed connections are retried with backoff."""
+    kwargs.setdefault('timeout', settings.FETCH_TIMEOUT)
+    host = urlsplit(url).hostname or ''
+    limiter = host_limiters[host]
+
+    def attempt() -> requests.Response:
+        limiter.acquire()
+        with _host_semaphore(host), metrics.span('fetch'):
+            r = session.get(url, **kwargs)
+        if r.status_code in (429, 503):
+            r.close()
+            limiter.throttle()
+            metrics.incr('throttled', target='fetch')
+            retry_after = r.headers.get('Retry-After', '')
+            raise Throttled(f'{r.status_code} {url}', float(retry_after) if retry_after.isdigit() else 0.0)
+        limiter.success()
+        return r
+
+    return retry(attempt, settings.FETCH_RETRIES, name='fetch')
+
+
+SAFE_ATTRS = frozenset({'src', 'href', 'alt', 'title', 'data-src'})
+KILL_TAGS = frozenset({'style', 'noscript'})
+REMOVE_TAGS = frozenset({'html', 'body', 'figure', 'div', 'section', 'noscript', 'footer', 'span'})
+# 去掉div标签、空图片以及（仅含div标签的）空p/span/svg，重复扫描直到外层空标签也被清除
+EMPTY_TAGS_RE = re.compile(r'<img (?:alt="" )?src=(?:"")?(?: /)?>|</?div>|<(p|span|svg)>(?:</?div>)*</\1>')
+
+
+@functools.lru_cache(maxsize=32)
+def get_cleaner(safe_attrs: frozenset, remove_tags: frozenset, kill_tags: frozenset) -> 'Cleaner':
+    from lxml.html.clean import Cleaner
+    return Cleaner(safe_attrs=safe_attrs, remove_tags=remove_tags, kill_tags=kill_tags)
 
 
 def clean_html(html_text, safe_attrs=None, remove_tags=None, kill_tags=None):
     if not html_text:
         return ""
-    safe_attrs = set(safe_attrs or []) | {'src', 'href', 'alt', 'title', 'data-src'}
-    kill_tags = set(kill_tags or []) | {'style', 'noscript'}
-    remove_tags = set(remove_tags or []) | {'html', 'body', 'figure', 'div', 'section', 'noscript', 'footer', 'span'}
-    cleaner = Cleaner(safe_attrs=safe_attrs, remove_tags=remove_tags, kill_tags=kill_tags)
-    cleaned_html = cleaner.clean_html(html_text)
-    if 'div' in (remove_tags or []):
-        cleaned_html = cleaned_html.replace('<div>', '')
-    cleaned_html = cleaned_html.replace("<img src="">", '').replace('<img alt="" src="" />', '').\
-        replace('<img src="">', '').replace('</div>', '').replace('<svg></svg>', '').replace('<span></span>', '').replace("<p></p>", '').strip()
-    return cleaned_html
-
-
-def collect_article(url: str) -> Metadata:
+    cleaner = get_cleaner(
+        SAFE_ATTRS | frozenset(safe_attrs or ()),
+        REMOVE_TAGS | frozenset(remove_tags or ()),
+        KILL_TAGS | frozenset(kill_tags or ())
+    )
+    cleaned, removed = EMPTY_TAGS_RE.subn('', cleaner.clean_html(html_text))
+    # 去掉内部空标签后外层可能变空，重复直到不再变化
+    while removed:
+        cleaned, removed = EMPTY_TAGS_RE.subn('', cleaned)
+    return cleaned.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def article_class():
+    from newspaper import Article
+    setattr(Article, 'release_resources', lambda *args, **kwargs: None)
+    return Article
+
+
+def parse_article(url: str, html: str) -> Optional[Metadata]:
+    """CPU-bound part of collect_article; a plain function so it can run in parse_executor."""
+    article = article_class()(url, keep_article_html=True, fetch_images=False, memoize_articles=False)
+    article.set_html(html)
+    article.parse()
+    if article.article_html:
+        return Metadata(
+            content=clean_html(article.article_html),
+            summary=article.meta_description,
+            title=article.title,
+            type='web_page',
+            keywords=article.keywords,
+            source=url
+        )
+
+
+def _mp_context():
+    # 多线程进程中fork可能复制到被其他线程持有的锁，子进程改用spawn启动
+    return multiprocessing.get_context('spawn')
+
+
+_parse_executor: Optional[ProcessPoolExecutor] = None
+
+
+def parse_executor() -> Optional[ProcessPoolExecutor]:
+    global _parse_executor
+    if _parse_executor is None and settings.PARSE_WORKERS:
+        _parse_executor = ProcessPoolExecutor(max_workers=settings.PARSE_WORKERS, mp_context=_mp_context())
+    return _parse_executor
+
+
+def read_limited(r: requests.Response, max_bytes: int) -> Optional[bytes]:
+    """Read a streamed body, giving up as soon as it exceeds max_bytes."""
+    if int(r.headers.get('Content-Length') or 0) > max_bytes:
+        return
+    body = bytearray()
+    for chunk in r.iter_content(chunk_size=64 * 1024):
+        body.extend(chunk)
+        if len(body) > max_bytes:
+            return
+    return bytes(body)
+
+
+def decode_body(body: bytes, headers) -> str:
+    """Decode body with the charset declared in Content-Type, or the one detected from its content."""
+    # 未声明charset时requests默认text/*为ISO-8859-1，因此只采用显式声明的编码
+    encoding = None
+    if 'charset' in headers.get('Content-Type', '').lower():
+        encoding = requests.utils.get_encoding_from_headers(headers)
+    if not encoding:
+        match = charset_normalizer.from_bytes(body).best()
+        encoding = match.encoding if match else 'utf-8'
+    try:
+        return body.decode(encoding, errors='replace')
+    except LookupError:
+        # 声明了未知的编码
+        return body.decode('utf-8', errors='replace')
+
+
+def collect_article(url: str) -> Optional[Metadata]:
+    entry = fetch_cache.get(url)
+    if entry and entry.fresh:
+        return entry.metadata
     url = AnyUrl(url)
     headers = {
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36 Edg/123.0.0.0',
-        'Origin': f'{url.scheme}://{url.host}'
+        'Origin': f'{url.scheme}://{url.host}',
+        **(entry.validators() if entry else {})
     }
-    r = requests.get(url, headers=headers)
-    r.encoding = r.apparent_encoding
-    if r.ok and (html := r.text):
-        article = Article(str(url), keep_article_html=True)
-        article.set_html(html)
-        article.parse()
-        if article.article_html:
-            article.article_html = clean_html(article.article_html)
-            return Metadata(
-                content=article.article_html,
-                summary=article.meta_description,
-                title=article.title,
-                type='web_page',
-                keywords=article.keywords,
-                source=str(url)
-            )
-
-
-def collect_pdf(url) -> str:
-    loader = PyPDFLoader(url)
-    if loader.web_path:
-        blob = Blob.from_data(open(loader.file_path, "rb").read(), path=loader.web_path)
-    else:
-        blob = Blob.from_path(loader.file_path)
-    with blob.as_bytes_io() as pdf_file_obj:
-        pdf_reader = pypdf.PdfReader(pdf_file_obj, password=None)
-        content = [page.extract_text() for page in pdf_reader.pages]
-    return ''.join(content)
+    with fetch(str(url), headers=headers, stream=True) as r:
+        if r.status_code == 304 and entry:
+            fetch_cache.touch(str(url))
+            return entry.metadata
+        if not r.ok:
+            return
+        body = read_limited(r, settings.MAX_HTML_BYTES)
+    if body is None:
+        logger.info(f"Skip page larger than {settings.MAX_HTML_BYTES} bytes: {url}")
+        metrics.incr('pages_oversized')
+        return
+    metrics.incr('bytes_fetched', len(body), kind='html')
+    if html := decode_body(body, r.headers):
+        with metrics.span('parse_html'):
+            if executor := parse_executor():
+                metadata = executor.submit(parse_article, str(url), html).result()
+            else:
+                metadata = parse_article(str(url), html)
+        # 无正文的页面也缓存，避免重复下载解析
+        fetch_cache.put(str(url), body, metadata, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        return metadata
+
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+
+def pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(max_workers=settings.PDF_WORKERS, mp_context=_mp_context())
+    return _pdf_executor
+
+
+def extract_pdf_pages(source: Union[str, 'pypdf.PdfReader'], start: int, stop: int, max_chars: int) -> List[str]:
+    """Extract pages [start, stop) one at a time, stopping once max_chars have been collected."""
+    import pypdf
+    reader = source if isinstance(source, pypdf.PdfReader) else pypdf.PdfReader(source)
+    texts, size = [], 0
+    for i in range(start, min(stop, len(reader.pages))):
+        text = reader.pages[i].extract_text() or ''
+        texts.append(text)
+        size += len(text)
+        if size >= max_chars:
+            break
+    return texts
+
+
+def extract_pdf_text(path: str, max_chars: int) -> str:
+    import pypdf
+    reader = pypdf.PdfReader(path)
+    num_pages = len(reader.pages)
+    if num_pages < settings.PDF_PARALLEL_PAGES:
+        return ''.join(extract_pdf_pages(reader, 0, num_pages, max_chars))
+    # 长论文按页段分发到进程池，按顺序合并，够用即取消剩余任务
+    step = settings.PDF_PAGES_PER_TASK
+    futures = [
+        pdf_executor().submit(extract_pdf_pages, path, start, start + step, max_chars)
+        for start in range(0, num_pages, step)
+    ]
+    texts, size = [], 0
+    try:
+        for future in futures:
+            for text in future.result():
+                texts.append(text)
+                size += len(text)
+                if size >= max_chars:
+                    return ''.join(texts)
+    finally:
+        for future in futures:
+            future.cancel()
+    return ''.join(texts)
+
+
+def collect_pdf(url, max_chars: int = None) -> str:
+    """Extracted text of the PDF at url, or '' when it is larger than PDF_MAX_BYTES."""
+    max_chars = max_chars or settings.PDF_MAX_CHARS
+    entry = fetch_cache.get(url)
+    if entry and entry.fresh:
+        return entry.metadata
+    with fetch(url, headers=entry.validators() if entry else {}, stream=True) as r:
+        if r.status_code == 304 and entry:
+            fetch_cache.touch(url)
+            return entry.metadata
+        r.raise_for_status()
+        # 流式写入临时文件，避免整份PDF驻留内存
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            size = 0
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > settings.PDF_MAX_BYTES:
+                    # 跳过超大PDF，由调用方退回到摘要
+                    logger.warning(f"Skip PDF larger than {settings.PDF_MAX_BYTES} bytes: {url}")
+                    metrics.incr('pdf_skipped', reason='size')
+                    return ''
+                f.write(chunk)
+            f.flush()
+            metrics.incr('bytes_fetched', size, kind='pdf')
+            with metrics.span('pdf_extract'):
+                content = extract_pdf_text(f.name, max_chars)
+    # 只缓存解析结果，原始PDF体积大且可重新下载
+    fetch_cache.put(url, b'', content, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+    return content
 
 
 def collect_url_content(url: str) -> Metadata:
     return collect_article(url)
 
 
+def collect_url_contents(urls: List[str], deadline: float = None) -> List[Optional[Metadata]]:
+    """Fetch urls concurrently; failed ones, or ones still running deadline seconds after they started, are returned
+    as None."""
+    deadline = deadline or settings.FETCH_DEADLINE
+    # fetch_executor为所有爬取共享，排队时间不计入deadline
+    tasks = [TimedTask(fetch_executor, collect_url_content, url) for url in urls]
+    results = []
+    for url, task in zip(urls, tasks):
+        try:
+            results.append(task.result(deadline))
+        except FutureTimeoutError:
+            logger.warning(f"Fetch timeout after {deadline}s: {url}")
+            results.append(None)
+        except Exception as e:
+            logger.warning(f"Fetch failed: {url} {e!r}")
+            results.append(None)
+    return results
+
+
 class ReadingResult(BaseModel):
     next_search_queries: List[str] = Field(description='下一步搜索内容')
     valuable_links: List[str] = Field(description='参考内容中有价值的链接')
     score_list: List[int] = Field(description='内容评分列表')
     summary: str = Field(description='总结')
+
+
+class ReadingResults(BaseModel):
+    results: List[ReadingResult] = Field(description='每条参考内容的分析结果，顺序与编号一致')
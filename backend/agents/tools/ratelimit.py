@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Generic, TypeVar
+
+import settings
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class Throttled(Exception):
+    """Raised when an upstream answers 429/202-ratelimit; carries the Retry-After delay if it sent one."""
+
+    def __init__(self, message: str = '', retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def is_throttle(exc: BaseException) -> bool:
+    if isinstance(exc, Throttled):
+        return True
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(exc, 'status_code', None)
+    if status == 429:
+        return True
+    # duckduckgo_search的RatelimitException等按异常类型识别，不匹配消息文本
+    return any('ratelimit' in cls.__name__.lower() or cls.__name__ == 'TooManyRequests' for cls in type(exc).__mro__)
+
+
+def is_transient(exc: BaseException) -> bool:
+    import requests
+    return is_throttle(exc) or isinstance(exc, (requests.ConnectionError, requests.Timeout, TimeoutError, ConnectionError))
+
+
+class TokenBucket:
+    """Token bucket whose rate adapts AIMD-style: +``increase`` per success, ×``decrease`` per throttle."""
+
+    def __init__(self, rate: float, max_rate: float, min_rate: float = 0.05, increase: float = 0.05,
+                 decrease: float = 0.5):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = max(1.0, rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 预约制：令牌可以为负，等待时间即欠下的令牌数/速率
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures; after ``cooldown`` lets one trial call through."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # half-open：放行一次试探并重新计时，冷却期内的其余调用仍抛出CircuitOpen
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class Registry(Generic[T]):
+    """Thread-safe get-or-create map, so every caller of the same key shares one limiter."""
+
+    def __init__(self, factory: Callable[[str], T]):
+        self.factory = factory
+        self._items: Dict[str, T] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> T:
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = self.factory(key)
+            return self._items[key]
+
+
+engine_limiters: Registry[TokenBucket] = Registry(lambda key: TokenBucket(
+    settings.SEARCH_RATE_LIMITS.get(key, settings.SEARCH_RATE), settings.SEARCH_RATE_MAX
+))
+engine_breakers: Registry[CircuitBreaker] = Registry(lambda key: CircuitBreaker(
+    settings.CIRCUIT_BREAKER_THRESHOLD, settings.CIRCUIT_BREAKER_COOLDOWN
+))
+host_limiters: Registry[TokenBucket] = Registry(lambda key: TokenBucket(
+    settings.FETCH_HOST_RATE, settings.FETCH_HOST_RATE_MAX
+))
+
+
+def retry(fn: Callable[[], T], retries: int, should_retry: Callable[[BaseException], bool] = is_transient,
+          name: str = '') -> T:
+    """Call fn, retrying with full-jitter exponential backoff (or the server's Retry-After when longer)."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not should_retry(e):
+                raise
+            delay = random.uniform(0, min(settings.RETRY_MAX_DELAY, settings.RETRY_BASE_DELAY * 2 ** attempt))
+            delay = max(delay, getattr(e, 'retry_after', 0.0) or 0.0)
+            metrics.incr('retries', target=name)
+            logger.info(f"Retry {name} in {delay:.2f}s after {e!r}")
+            time.sleep(delay)
+
+
+def limited(key: str, fn: Callable[[], T], retries: int = None) -> T:
+    """Run an engine call under its rate limiter, retry policy and circuit breaker."""
+    limiter, breaker = engine_limiters[key], engine_breakers[key]
+    if not breaker.allow():
+        metrics.incr('circuit_open', target=key)
+        raise CircuitOpen(f'{key} circuit open')
+
+    def attempt():
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            if is_throttle(e):
+                limiter.throttle()
+                metrics.incr('throttled', target=key)
+            raise
+        limiter.success()
+        return result
+
+    try:
+        result = retry(attempt, settings.SEARCH_RETRIES if retries is None else retries, name=key)
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.success()
+    return result
@@ -1,19 +1,32 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import functools
 import logging
-from typing import List, Literal, Callable
-from arxiv import Result
+from typing import List, Literal, Callable, TYPE_CHECKING
 from langchain_core.tools import BaseTool, tool
-from wikipedia import WikipediaPage
 
 from agents.tools.adapters import get_search_fn, SearchResult
-from langchain_community.utilities.arxiv import ArxivAPIWrapper
-from langchain_community.utilities.wikipedia import WikipediaAPIWrapper, WIKIPEDIA_MAX_QUERY_LENGTH
-from agents.tools.parsers import collect_url_content, collect_pdf, clean_html
+from agents.tools.parsers import collect_url_contents, collect_pdf, clean_html
+from cache import fetch_cache
 from documents import Query, Document, Metadata
 
-arxiv_wrapper = ArxivAPIWrapper()
-wiki_wrapper = WikipediaAPIWrapper()
+if TYPE_CHECKING:
+    from arxiv import Result
+    from langchain_community.utilities.arxiv import ArxivAPIWrapper
+    from langchain_community.utilities.wikipedia import WikipediaAPIWrapper
+    from wikipedia import WikipediaPage
+
+
+@functools.lru_cache(maxsize=None)
+def get_arxiv_wrapper() -> 'ArxivAPIWrapper':
+    from langchain_community.utilities.arxiv import ArxivAPIWrapper
+    return ArxivAPIWrapper()
+
+
+@functools.lru_cache(maxsize=None)
+def get_wiki_wrapper() -> 'WikipediaAPIWrapper':
+    from langchain_community.utilities.wikipedia import WikipediaAPIWrapper
+    return WikipediaAPIWrapper()
 
 
 logger = logging.getLogger(__name__)
@@ -37,8 +50,9 @@ class SearchEngine(BaseTool):
     def _run(self, query: str) -> List[Document]:
         results = self.fn(query)
         docs = []
-        for res in results:
-            metadata = collect_url_content(res['link'])
+        for res, metadata in zip(results, collect_url_contents([res['link'] for res in results])):
+            if not metadata:
+                continue
             metadata.update({**res, 'query': query})
             doc = Document.create(metadata=metadata)
             docs.append(doc)
@@ -48,23 +62,33 @@ class SearchEngine(BaseTool):
 @tool
 def search_with_wiki(concept: str) -> List[Document]:
     """"A wrapper around Wikipedia. Useful for when you need to Understand complex concepts."""
+    from langchain_community.utilities.wikipedia import WIKIPEDIA_MAX_QUERY_LENGTH
+    wiki_wrapper = get_wiki_wrapper()
     page_titles = wiki_wrapper.wiki_client.search(
         concept[:WIKIPEDIA_MAX_QUERY_LENGTH], results=wiki_wrapper.top_k_results
     )
     docs = []
     for page_title in page_titles[: wiki_wrapper.top_k_results]:
+        page_url = f"https://{wiki_wrapper.lang}.wikipedia.org/wiki/{page_title.replace(' ', '_')}"
+        entry = fetch_cache.get(page_url)
+        if entry and entry.fresh:
+            meta_data = Metadata(**entry.metadata, query=concept)
+            docs.append(Document.create(metadata=meta_data))
+            continue
         wiki_page = wiki_wrapper.wiki_client.page(title=page_title, auto_suggest=False)
         if wiki_page:
-            wiki_page: WikipediaPage
+            wiki_page: 'WikipediaPage'
+            html = wiki_page.html()
             meta_data = Metadata(
-                content=clean_html(wiki_page.html()),
+                content=clean_html(html),
                 summary=wiki_page.summary,
                 title=wiki_page.title,
                 type='wiki',
                 keywords='',
                 source=wiki_page.url,
-                query=concept
             )
+            fetch_cache.put(page_url, html.encode(), meta_data)
+            meta_data['query'] = concept
             doc = Document.create(metadata=meta_data)
             docs.append(doc)
     return docs
@@ -75,21 +99,27 @@ def search_with_arxiv(query: str) -> List[Document]:
     """A wrapper around Arxiv.org. Useful for when you need to answer questions about Physics, Mathematics,
     Computer Science, Quantitative Biology, Quantitative Finance, Statistics, Electrical Engineering, and Economics
     from scientific articles on arxiv.org.Input should be a search query."""
+    arxiv_wrapper = get_arxiv_wrapper()
     if arxiv_wrapper.is_arxiv_identifier(query):
         results = arxiv_wrapper.arxiv_search(
             id_list=query.split(),
             max_results=arxiv_wrapper.top_k_results,
         ).results()
     else:
-        results = self.arxiv_search(  # type: ignore
+        results = arxiv_wrapper.arxiv_search(
             query[: arxiv_wrapper.ARXIV_MAX_QUERY_LENGTH], max_results=3
         ).results()
     docs = []
     for res in results:
-        res: Result
+        res: 'Result'
         res.categories.append(res.primary_category)
         keywords = ', '.join(res.categories)
-        content = collect_pdf(url=res.pdf_url)
+        try:
+            content = collect_pdf(url=res.pdf_url)
+        except Exception as e:
+            # 单篇论文下载失败不影响同批其他结果，正文留空退回到摘要
+            logger.warning(f"Collect PDF failed: {res.pdf_url} {e!r}")
+            content = ''
         doc = Document.create(metadata=Metadata(
             content=content,
             summary=res.summary,
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of HTML cleaning/extraction over a corpus of saved pages.
+
+Run from backend/:
+    python -m benchmarks.bench_html data/pages --baseline bench_html.json
+Pages are ``*.html`` files; the file stem is used as the page url. With ``--baseline`` the run is compared against
+the saved timings and exits non-zero if any stage got slower than ``--tolerance``; ``--update`` rewrites them.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from agents.tools.parsers import clean_html, parse_article
+
+
+def timeit(fn: Callable, pages: List[str], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        for page in pages:
+            start = time.perf_counter()
+            fn(page)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p95_ms': timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', type=Path)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', type=Path)
+    parser.add_argument('--update', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    files = sorted(args.corpus.glob('*.html'))
+    if not files:
+        sys.exit(f'No *.html pages in {args.corpus}')
+    pages = {f'https://{f.stem}/': f.read_text(encoding='utf-8', errors='ignore') for f in files}
+    report = {
+        'clean_html': timeit(clean_html, list(pages.values()), args.repeat),
+        'parse_article': timeit(lambda item: parse_article(*item), list(pages.items()), args.repeat),
+    }
+    print(json.dumps({'pages': len(pages), **report}, indent=2))
+
+    if not args.baseline:
+        return
+    if args.update or not args.baseline.exists():
+        args.baseline.write_text(json.dumps(report, indent=2))
+        return
+    baseline = json.loads(args.baseline.read_text())
+    regressions = [
+        f"{stage}: {report[stage]['mean_ms']:.2f}ms vs {old['mean_ms']:.2f}ms"
+        for stage, old in baseline.items()
+        if stage in report and report[stage]['mean_ms'] > old['mean_ms'] * (1 + args.tolerance)
+    ]
+    if regressions:
+        sys.exit('Regression: ' + '; '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Import-time budget for the backend entry points, measured in fresh interpreters with ``-X importtime``.
+
+Run from backend/:
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --baseline bench_import.json
+Exits non-zero if a module imports something listed in LAZY_MODULES, goes over ``--budget-ms`` (default
+BUDGET_MS, 0 disables it), or (with ``--baseline``) got slower than ``--tolerance``; ``--update`` rewrites the
+baseline.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+MODULES = ['agents.tools.search', 'agents.factory', 'main', 'server']
+BUDGET_MS = 3000
+# 这些依赖只应在首次使用时导入；langchain_text_splitters只要已安装就会被langchain_core导入，不在此列
+LAZY_MODULES = [
+    'newspaper', 'pypdf', 'lxml.html.clean', 'arxiv', 'wikipedia', 'duckduckgo_search', 'langchain.chains',
+    'langchain_community.utilities.arxiv', 'langchain_community.utilities.wikipedia',
+    'langchain_community.utilities.google_search', 'langchain_community.utilities.bing_search',
+    'langchain_community.utilities.duckduckgo_search', 'langchain_community.utilities.brave_search',
+    'langchain_community.utilities.searx_search', 'langchain_community.utilities.tavily_search',
+]
+LINE_RE = re.compile(r'import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)')
+
+
+def import_profile(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """Cumulative import time of module in ms, and (name, cumulative ms) of every module it pulled in."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, capture_output=True, text=True, env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    )
+    if result.returncode:
+        sys.exit(f'import {module} failed:\n{result.stderr[-2000:]}')
+    imported, total = [], 0.0
+    for line in result.stderr.splitlines():
+        if match := LINE_RE.match(line):
+            name, cumulative = match.group(2), int(match.group(1)) / 1000
+            imported.append((name, cumulative))
+            if name == module:
+                total = cumulative
+    return total, imported
+
+
+def measure(module: str, repeat: int) -> Dict:
+    runs = [import_profile(module) for _ in range(repeat)]
+    _, imported = runs[-1]
+    names = {name for name, _ in imported}
+    return {
+        'median_ms': statistics.median(total for total, _ in runs),
+        'eager': sorted(lazy for lazy in LAZY_MODULES if lazy in names),
+        'slowest': [
+            {'module': name, 'ms': ms} for name, ms in sorted(imported, key=lambda item: -item[1])[:10]
+            if name != module
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS)
+    parser.add_argument('--baseline', type=Path)
+    parser.add_argument('--update', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = {module: measure(module, args.repeat) for module in args.modules}
+    print(json.dumps(report, indent=2))
+
+    failures = [f"{module} imports {', '.join(r['eager'])} eagerly" for module, r in report.items() if r['eager']]
+    if args.budget_ms:
+        failures += [
+            f"{module}: {r['median_ms']:.0f}ms over {args.budget_ms:.0f}ms budget"
+            for module, r in report.items() if r['median_ms'] > args.budget_ms
+        ]
+    if args.baseline:
+        timings = {module: {'median_ms': r['median_ms']} for module, r in report.items()}
+        if args.update or not args.baseline.exists():
+            args.baseline.write_text(json.dumps(timings, indent=2))
+        else:
+            baseline = json.loads(args.baseline.read_text())
+            failures += [
+                f"{module}: {timings[module]['median_ms']:.0f}ms vs {old['median_ms']:.0f}ms"
+                for module, old in baseline.items()
+                if module in timings and timings[module]['median_ms'] > old['median_ms'] * (1 + args.tolerance)
+            ]
+    if failures:
+        sys.exit('Regression: ' + '; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
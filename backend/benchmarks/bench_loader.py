@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""End-to-end SearchLoader benchmark on replayed fixtures, no network needed.
+
+Run from backend/:
+    python -m benchmarks.bench_loader --scales 10 100 1000 10000 --llm-latency 0.05
+    python -m benchmarks.bench_loader --fixture data/bench.json          # replay a recording
+    python -m benchmarks.bench_loader --fixture data/bench.json --record --topic 'AI Agent' --scales 20
+Reports documents/sec, tokens/sec, peak traced memory and time per stage for each crawl size, and exits non-zero
+if any reader call failed.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Any
+
+from benchmarks.fixtures import Fixture, Latency, ReplayChatModel, RecordingChatModel, replay, record
+from main import SearchLoader
+from metrics import metrics
+
+
+def run(topic: str, max_documents: int, llm, config: Dict[str, Any]) -> Dict[str, Any]:
+    loader = SearchLoader(topic, config={'max_documents': max_documents, 'llm_cache': None, **config}, llm=llm)
+    baseline = metrics.snapshot()
+    tracemalloc.start()
+    start = time.perf_counter()
+    docs = loader.load()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report = metrics.report(baseline)
+    stages: Dict[str, float] = {}
+    for item in report['stages']:
+        stages[item['stage']] = stages.get(item['stage'], 0) + item['seconds']
+    return {
+        'max_documents': max_documents,
+        'documents': len(docs),
+        'tokens': loader.tree.tokens,
+        'seconds': elapsed,
+        'documents_per_sec': len(docs) / elapsed if elapsed else 0.0,
+        'tokens_per_sec': loader.tree.tokens / elapsed if elapsed else 0.0,
+        'peak_memory_mb': peak / 1024 ** 2,
+        'reader_failures': sum(item['value'] for item in report['counters'] if item['name'] == 'reader_failures'),
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--topic', default='AI Agent')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--fixture', type=Path)
+    parser.add_argument('--record', action='store_true', help='crawl live and save responses to --fixture')
+    parser.add_argument('--llm-latency', type=float, default=0.0)
+    parser.add_argument('--search-latency', type=float, default=0.0)
+    parser.add_argument('--fetch-latency', type=float, default=0.0)
+    parser.add_argument('--config', type=json.loads, default={}, help='extra ConfigDict entries as JSON')
+    args = parser.parse_args()
+
+    if args.record and not args.fixture:
+        parser.error('--record needs --fixture')
+    metrics.enabled = True
+    fixture = Fixture.load(args.fixture) if args.fixture else Fixture()
+    if args.record:
+        from langchain_openai import ChatOpenAI
+        llm = RecordingChatModel(inner=ChatOpenAI(), fixture=fixture)
+        with record(fixture):
+            for scale in args.scales:
+                print(json.dumps(run(args.topic, scale, llm, args.config)))
+        fixture.save(args.fixture)
+        return
+
+    latency = Latency(llm=args.llm_latency, search=args.search_latency, fetch=args.fetch_latency)
+    llm = ReplayChatModel(fixture=fixture, latency=latency.llm)
+    failures = []
+    with replay(fixture, latency):
+        for scale in args.scales:
+            result = run(args.topic, scale, llm, args.config)
+            print(json.dumps(result))
+            if result['reader_failures']:
+                failures.append(f"{result['reader_failures']:.0f} reader failures at {scale} documents")
+    # reader失败时爬取会提前停止，吞吐数据不可信
+    if failures:
+        sys.exit('Reader failed: ' + '; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
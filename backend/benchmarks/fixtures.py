@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Record/replay stand-ins for the network-bound parts of SearchLoader.
+
+A fixture is one JSON file::
+
+    {"llm": {prompt_hash: {"content": str, "tool_calls": [{"name", "args"}]}},
+     "search": {normalized query: [SearchResult]},
+     "pages": {url: Metadata | null},
+     "pdfs": {url: str},
+     "wiki": {normalized query: [page title]},
+     "wiki_pages": {page title: {"title", "summary", "url", "html"} | null},
+     "arxiv": {normalized query: [{"title", "summary", "pdf_url", "categories", "primary_category"}]}}
+
+Anything missing from the fixture is generated deterministically from the request, so the same fixture can drive
+crawls far larger than the one it was recorded from.
+"""
+import contextlib
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence, Iterator
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+import agents.tools.parsers
+import agents.tools.search
+from agents.tools.adapters import SearchResult
+from documents import Metadata
+from utils import normalize_query
+
+WORDS = (
+    'agent model search index crawl token reader query document source topic summary vector graph memory tool '
+    'planner language retrieval context benchmark latency network cache budget score frontier chunk page paper'
+).split()
+# 与langchain的ArxivAPIWrapper/WikipediaAPIWrapper默认值一致
+ARXIV_MAX_QUERY_LENGTH = 300
+TOP_K_RESULTS = 3
+
+
+def prompt_hash(messages: Sequence[BaseMessage]) -> str:
+    return hashlib.sha256(json.dumps([m.content for m in messages], ensure_ascii=False).encode()).hexdigest()
+
+
+def _rng(*key: Any) -> random.Random:
+    return random.Random(hashlib.sha256(repr(key).encode()).digest())
+
+
+class Fixture:
+    def __init__(self, data: Optional[Dict[str, dict]] = None, path: Optional[Path] = None):
+        data = data or {}
+        self.path = path
+        self.llm: Dict[str, dict] = data.get('llm', {})
+        self.search: Dict[str, List[SearchResult]] = data.get('search', {})
+        self.pages: Dict[str, Optional[Metadata]] = data.get('pages', {})
+        self.pdfs: Dict[str, str] = data.get('pdfs', {})
+        self.wiki: Dict[str, List[str]] = data.get('wiki', {})
+        self.wiki_pages: Dict[str, Optional[dict]] = data.get('wiki_pages', {})
+        self.arxiv: Dict[str, List[dict]] = data.get('arxiv', {})
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> 'Fixture':
+        path = Path(path)
+        data = json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+        return cls(data, path)
+
+    def save(self, path: Optional[Path] = None):
+        path = Path(path or self.path)
+        with self._lock:
+            data = {
+                'llm': self.llm, 'search': self.search, 'pages': self.pages, 'pdfs': self.pdfs, 'wiki': self.wiki,
+                'wiki_pages': self.wiki_pages, 'arxiv': self.arxiv
+            }
+            path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+
+    def record(self, kind: str, key: str, value: Any):
+        with self._lock:
+            getattr(self, kind)[key] = value
+
+
+class Latency:
+    def __init__(self, llm: float = 0.0, search: float = 0.0, fetch: float = 0.0):
+        self.llm = llm
+        self.search = search
+        self.fetch = fetch
+
+
+def synthetic_results(query: str, num_results: int) -> List[SearchResult]:
+    digest = hashlib.sha256(normalize_query(query).encode()).hexdigest()[:12]
+    results = []
+    for i in range(num_results):
+        link = f'https://bench.local/{digest}/{i}'
+        # 摘要需各不相同，否则会覆盖页面摘要并被当作近似重复去掉
+        rng = _rng('snippet', link)
+        summary = ' '.join(rng.choice(WORDS) for _ in range(30))
+        results.append(SearchResult(title=f'{query} #{i}', link=link, summary=summary))
+    return results
+
+
+def synthetic_page(url: str, paragraphs: int = 12) -> Metadata:
+    rng = _rng('page', url)
+    body = ''.join(
+        '<p>' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))) + '.</p>'
+        for _ in range(paragraphs)
+    )
+    return Metadata(
+        content=body, summary=' '.join(rng.choice(WORDS) for _ in range(30)), title=f'Page {url.rsplit("/", 2)[-2]}',
+        type='web_page', keywords='', source=url
+    )
+
+
+def synthetic_pdf(url: str) -> str:
+    rng = _rng('pdf', url)
+    return '\n'.join(' '.join(rng.choice(WORDS) for _ in range(200)) for _ in range(20))
+
+
+def synthetic_wiki_titles(query: str, num_results: int) -> List[str]:
+    return [f'{query} ({i})' for i in range(num_results)]
+
+
+def synthetic_wiki_page(title: str) -> dict:
+    url = f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+    page = synthetic_page(url)
+    return {'title': title, 'summary': page['summary'], 'url': url, 'html': page['content']}
+
+
+def synthetic_arxiv(query: str, num_results: int) -> List[dict]:
+    digest = hashlib.sha256(query.encode()).hexdigest()[:12]
+    results = []
+    for i in range(num_results):
+        rng = _rng('arxiv', digest, i)
+        results.append({
+            'title': f'{query} paper {i}', 'summary': ' '.join(rng.choice(WORDS) for _ in range(60)),
+            'pdf_url': f'https://bench.local/arxiv/{digest}/{i}.pdf', 'categories': ['cs.AI'], 'primary_category': 'cs.CL'
+        })
+    return results
+
+
+class WikiPage:
+    """Stand-in for wikipedia.WikipediaPage with the attributes search_with_wiki reads."""
+
+    def __init__(self, title: str, summary: str, url: str, html: str):
+        self.title = title
+        self.summary = summary
+        self.url = url
+        self._html = html
+
+    def html(self) -> str:
+        return self._html
+
+
+def arxiv_result(data: dict) -> SimpleNamespace:
+    # search_with_arxiv会修改categories，每次给出新列表
+    return SimpleNamespace(**{**data, 'categories': list(data['categories'])})
+
+
+# 与ArxivAPIWrapper.is_arxiv_identifier相同的规则
+ARXIV_ID_RE = re.compile(r'\d{2}(0[1-9]|1[0-2])\.\d{4,5}(v\d+|)|\d{7}.*')
+
+
+def is_arxiv_identifier(query: str) -> bool:
+    return all(ARXIV_ID_RE.fullmatch(item) for item in query[:ARXIV_MAX_QUERY_LENGTH].split())
+
+
+
+DOCUMENT_NUMBER_RE = re.compile(r'^\[(\d+)] ', re.M)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model answering from a fixture; searcher turns become a search_engine tool call and reader turns a
+    ReadingResult JSON (a ReadingResults one per numbered document for packed prompts) when the prompt was not
+    recorded."""
+    fixture: Fixture
+    latency: float = 0.0
+    queries_per_document: int = 2
+
+    @property
+    def _llm_type(self) -> str:
+        return 'replay'
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _synthetic(self, messages: Sequence[BaseMessage]) -> dict:
+        human = messages[-1].content
+        # reader的格式说明在system消息中
+        instructions = messages[0].content
+        rng = _rng('llm', human)
+        if 'next_search_queries' in instructions:
+            def reading_result():
+                queries = [' '.join(rng.sample(WORDS, 3)) for _ in range(self.queries_per_document)]
+                return {
+                    'next_search_queries': queries, 'valuable_links': [],
+                    'score_list': [rng.randint(1, 10) for _ in range(3)], 'summary': ' '.join(rng.sample(WORDS, 8))
+                }
+            # 合并的prompt按ReadingResults格式，每个编号文档一条结果
+            if '"results"' in instructions:
+                numbers = DOCUMENT_NUMBER_RE.findall(human)
+                return {'content': json.dumps({'results': [reading_result() for _ in numbers]})}
+            return {'content': json.dumps(reading_result())}
+        return {'content': '', 'tool_calls': [{'name': 'search_engine', 'args': {'query': human[:200]}}]}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        response = self.fixture.llm.get(prompt_hash(messages)) or self._synthetic(messages)
+        return ChatResult(generations=[ChatGeneration(message=to_message(response))])
+
+
+def to_message(response: dict) -> AIMessage:
+    tool_calls = [{'name': c['name'], 'args': c['args'], 'id': f'call_{i}'} for i, c in enumerate(response.get('tool_calls') or [])]
+    return AIMessage(
+        content=response.get('content') or '',
+        tool_calls=tool_calls,
+        additional_kwargs={'tool_calls': [
+            {'id': c['id'], 'type': 'function', 'function': {'name': c['name'], 'arguments': json.dumps(c['args'])}}
+            for c in tool_calls
+        ]} if tool_calls else {}
+    )
+
+
+class RecordingChatModel(BaseChatModel):
+    """Wraps a live chat model and stores every response in the fixture."""
+    inner: BaseChatModel
+    fixture: Fixture
+
+    @property
+    def _llm_type(self) -> str:
+        return 'recording'
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        result = self.inner._generate(messages, stop=stop, **kwargs)
+        message = result.generations[0].message
+        self.fixture.record('llm', prompt_hash(messages), {
+            'content': message.content,
+            'tool_calls': [{'name': c['name'], 'args': c['args']} for c in getattr(message, 'tool_calls', None) or []]
+        })
+        return result
+
+
+@contextlib.contextmanager
+def replay(fixture: Fixture, latency: Optional[Latency] = None) -> Iterator[Fixture]:
+    """Serve search results, pages and PDFs from the fixture instead of the network."""
+    latency = latency or Latency()
+
+    def get_search_fn(name: str, num_results: int):
+        def search(query):
+            if latency.search:
+                time.sleep(latency.search)
+            return fixture.search.get(normalize_query(query)) or synthetic_results(query, num_results)
+        return lambda: search
+
+    def collect_article(url: str) -> Optional[Metadata]:
+        if latency.fetch:
+            time.sleep(latency.fetch)
+        page = fixture.pages[url] if url in fixture.pages else synthetic_page(url)
+        return dict(page) if page else None
+
+    def collect_pdf(url: str, max_chars: int = None) -> str:
+        if latency.fetch:
+            time.sleep(latency.fetch)
+        return fixture.pdfs.get(url) or synthetic_pdf(url)
+
+    def wiki_search(query: str, results: int = TOP_K_RESULTS) -> List[str]:
+        if latency.search:
+            time.sleep(latency.search)
+        titles = fixture.wiki.get(normalize_query(query))
+        return titles if titles is not None else synthetic_wiki_titles(query, results)
+
+    def wiki_page(title: str, auto_suggest: bool = False) -> Optional[WikiPage]:
+        if latency.fetch:
+            time.sleep(latency.fetch)
+        page = fixture.wiki_pages[title] if title in fixture.wiki_pages else synthetic_wiki_page(title)
+        return WikiPage(**page) if page else None
+
+    def arxiv_search(query: str = '', id_list: Sequence[str] = (), max_results: int = TOP_K_RESULTS):
+        if latency.search:
+            time.sleep(latency.search)
+        key = normalize_query(query or ' '.join(id_list))
+        results = fixture.arxiv.get(key)
+        results = results if results is not None else synthetic_arxiv(key, max_results)
+        return SimpleNamespace(results=lambda: [arxiv_result(r) for r in results])
+
+    wiki = SimpleNamespace(
+        lang='en', top_k_results=TOP_K_RESULTS, wiki_client=SimpleNamespace(search=wiki_search, page=wiki_page)
+    )
+    arxiv = SimpleNamespace(
+        top_k_results=TOP_K_RESULTS, ARXIV_MAX_QUERY_LENGTH=ARXIV_MAX_QUERY_LENGTH,
+        is_arxiv_identifier=is_arxiv_identifier, arxiv_search=arxiv_search
+    )
+    with _patched(get_search_fn, collect_article, collect_pdf, lambda: wiki, lambda: arxiv):
+        yield fixture
+
+
+@contextlib.contextmanager
+def record(fixture: Fixture) -> Iterator[Fixture]:
+    """Pass through to the live functions, storing what they return in the fixture."""
+    live_search_fn = agents.tools.search.get_search_fn
+    live_article = agents.tools.parsers.collect_article
+    live_pdf = agents.tools.search.collect_pdf
+    live_wiki = agents.tools.search.get_wiki_wrapper
+    live_arxiv = agents.tools.search.get_arxiv_wrapper
+
+    def get_search_fn(name: str, num_results: int):
+        fn_wrap = live_search_fn(name, num_results)
+
+        def search_wrap():
+            search = fn_wrap()
+
+            def recorded(query):
+                results = search(query)
+                fixture.record('search', normalize_query(query), results)
+                return results
+            return recorded
+        return search_wrap
+
+    def collect_article(url: str) -> Optional[Metadata]:
+        page = live_article(url)
+        fixture.record('pages', url, page)
+        return page
+
+    def collect_pdf(url: str, max_chars: int = None) -> str:
+        content = live_pdf(url, max_chars)
+        fixture.record('pdfs', url, content)
+        return content
+
+    def get_wiki_wrapper():
+        wrapper = live_wiki()
+
+        def search(query: str, results: int = TOP_K_RESULTS) -> List[str]:
+            titles = list(wrapper.wiki_client.search(query, results=results))
+            fixture.record('wiki', normalize_query(query), titles)
+            return titles
+
+        def page(title: str, auto_suggest: bool = False) -> Optional[WikiPage]:
+            live_page = wrapper.wiki_client.page(title=title, auto_suggest=auto_suggest)
+            data = {
+                'title': live_page.title, 'summary': live_page.summary, 'url': live_page.url, 'html': live_page.html()
+            } if live_page else None
+            fixture.record('wiki_pages', title, data)
+            return WikiPage(**data) if data else None
+
+        return SimpleNamespace(
+            lang=wrapper.lang, top_k_results=wrapper.top_k_results,
+            wiki_client=SimpleNamespace(search=search, page=page)
+        )
+
+    def get_arxiv_wrapper():
+        wrapper = live_arxiv()
+
+        def arxiv_search(query: str = '', id_list: Sequence[str] = (), max_results: int = TOP_K_RESULTS):
+            search = wrapper.arxiv_search(query, id_list=list(id_list), max_results=max_results)
+            results = [{
+                'title': r.title, 'summary': r.summary, 'pdf_url': r.pdf_url, 'categories': list(r.categories),
+                'primary_category': r.primary_category
+            } for r in search.results()]
+            fixture.record('arxiv', normalize_query(query or ' '.join(id_list)), results)
+            return SimpleNamespace(results=lambda: [arxiv_result(r) for r in results])
+
+        return SimpleNamespace(
+            top_k_results=wrapper.top_k_results, ARXIV_MAX_QUERY_LENGTH=wrapper.ARXIV_MAX_QUERY_LENGTH,
+            is_arxiv_identifier=wrapper.is_arxiv_identifier, arxiv_search=arxiv_search
+        )
+
+    with _patched(get_search_fn, collect_article, collect_pdf, get_wiki_wrapper, get_arxiv_wrapper):
+        yield fixture
+
+
+@contextlib.contextmanager
+def _patched(get_search_fn, collect_article, collect_pdf, get_wiki_wrapper, get_arxiv_wrapper):
+    search = agents.tools.search
+    originals = (
+        search.get_search_fn, agents.tools.parsers.collect_article, search.collect_pdf, search.get_wiki_wrapper,
+        search.get_arxiv_wrapper
+    )
+    search.get_search_fn = get_search_fn
+    # collect_url_content在调用时才查找collect_article
+    agents.tools.parsers.collect_article = collect_article
+    search.collect_pdf = collect_pdf
+    # search_with_wiki/search_with_arxiv每次调用时才取wrapper
+    search.get_wiki_wrapper = get_wiki_wrapper
+    search.get_arxiv_wrapper = get_arxiv_wrapper
+    try:
+        yield
+    finally:
+        (search.get_search_fn, agents.tools.parsers.collect_article, search.collect_pdf, search.get_wiki_wrapper,
+         search.get_arxiv_wrapper) = originals
@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Optional, NamedTuple, Any, Dict, Callable, Hashable, Tuple, List, Sequence
+
+import numpy as np
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.embeddings import Embeddings
+from langchain_core.load import dumps, loads
+
+import settings
+from metrics import metrics
+from utils import normalize_url
+
+logger = logging.getLogger(__name__)
+# lookup未命中后等待update的向量数上限，调用失败时不会被取走
+PENDING_VECTORS = 1024
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    metadata: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh: bool
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class SQLiteCache:
+    """Lazily opened, thread-shared SQLite connection created with SCHEMA."""
+    SCHEMA: List[str] = []
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+
+class FetchCache(SQLiteCache):
+    """SQLite cache of fetched bytes and parsed metadata, keyed by normalized url."""
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS fetch_cache ('
+        'key TEXT PRIMARY KEY, body BLOB, metadata TEXT, etag TEXT, last_modified TEXT, '
+        'size INTEGER, fetched_at REAL, accessed_at REAL)',
+        'CREATE INDEX IF NOT EXISTS fetch_cache_accessed ON fetch_cache (accessed_at)',
+    ]
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = None, max_bytes: int = None):
+        super().__init__(path or settings.DATA_DIR / settings.FETCH_CACHE_FILE)
+        self.ttl = ttl if ttl is not None else settings.FETCH_CACHE_TTL
+        self.max_bytes = max_bytes or settings.FETCH_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """Return the entry even if it is stale (counted as a miss), so the caller can revalidate it."""
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT body, metadata, etag, last_modified, fetched_at FROM fetch_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.incr('cache_misses', cache='fetch')
+                return
+            self.conn.execute('UPDATE fetch_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            body, metadata, etag, last_modified, fetched_at = row
+            fresh = now - fetched_at < self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            metrics.incr('cache_hits' if fresh else 'cache_misses', cache='fetch')
+        return CacheEntry(body, json.loads(metadata), etag, last_modified, fresh)
+
+    def put(self, url: str, body: bytes, metadata: Any, etag: str = None, last_modified: str = None):
+        key = normalize_url(url)
+        now = time.time()
+        body = body or b''
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO fetch_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, body, json.dumps(metadata, ensure_ascii=False), etag, last_modified, len(body), now, now)
+            )
+            self._evict()
+
+    def touch(self, url: str):
+        """Mark a stale entry fresh again after a 304 Not Modified."""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'UPDATE fetch_cache SET fetched_at = ?, accessed_at = ? WHERE key = ?', (now, now, normalize_url(url))
+            )
+            self.revalidated += 1
+            metrics.incr('cache_revalidated', cache='fetch')
+
+    def _evict(self):
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM fetch_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute('SELECT key, size FROM fetch_cache ORDER BY accessed_at').fetchall():
+            self.conn.execute('DELETE FROM fetch_cache WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class MemoCache:
+    """In-memory TTL/LRU memo; concurrent misses on the same key are merged into a single call."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_call(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item and item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                metrics.incr('cache_hits', cache=self.name)
+                return item[1]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.merged += 1
+            metrics.incr('cache_misses' if owner else 'cache_merged', cache=self.name)
+        if not owner:
+            return future.result()
+        try:
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses + self.merged
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'merged': self.merged,
+            'hit_rate': (self.hits + self.merged) / lookups if lookups else 0.0,
+        }
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _total_tokens(generations: Sequence) -> int:
+    total = 0
+    for generation in generations:
+        message = getattr(generation, 'message', None)
+        usage = getattr(message, 'usage_metadata', None) or {}
+        if not usage and message is not None:
+            usage = message.response_metadata.get('token_usage') or {}
+        total += usage.get('total_tokens') or 0
+    return total
+
+
+class SimilarityIndex:
+    """Normalized vectors kept in one growable matrix for brute-force cosine search; removal swaps in the last row."""
+
+    def __init__(self, dim: int):
+        self.keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str, vector: np.ndarray):
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self._matrix):
+                # 容量按倍数增长，追加摊销为O(1)
+                grown = np.empty((max(2 * row, 64), self._matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self._matrix
+                self._matrix = grown
+            self.keys.append(key)
+            self._rows[key] = row
+        self._matrix[row] = vector
+
+    def remove(self, key: str):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        last = self.keys.pop()
+        if last != key:
+            self.keys[row] = last
+            self._rows[last] = row
+            self._matrix[row] = self._matrix[len(self.keys)]
+
+    def nearest(self, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        if not self.keys:
+            return None, 0.0
+        scores = self._matrix[:len(self.keys)] @ vector
+        best = int(np.argmax(scores))
+        return self.keys[best], float(scores[best])
+
+
+def semantic_parts(prompt: str) -> Tuple[str, str]:
+    """(fixed context, variable text) of a prompt. For chat prompts (langchain passes ``dumps(messages)``) the text
+    is the last human message and the context all the other messages; any other prompt is all text."""
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return '', prompt
+    if isinstance(messages, list):
+        for i in range(len(messages) - 1, -1, -1):
+            kwargs = messages[i].get('kwargs') if isinstance(messages[i], dict) else None
+            if kwargs and kwargs.get('type') == 'human' and isinstance(kwargs.get('content'), str):
+                return json.dumps(messages[:i] + messages[i + 1:], sort_keys=True), kwargs['content']
+    return '', prompt
+
+
+class LLMCache(SQLiteCache, BaseCache):
+    """Persistent LLM response cache keyed by hash(llm_string) and hash(prompt).
+
+    For chat models langchain puts the model name, parameters and bound tool schemas into ``llm_string``, so a
+    cached completion is only reused for the same model and tools. With ``embeddings`` set, an exact miss falls back
+    to the most similar cached prompt above ``similarity`` among those with the same llm_string and the same other
+    messages, comparing only the last human message (see semantic_parts); the ``llm_hash`` column holds the hash of
+    that group. Each group's embeddings are read from SQLite once and then kept in memory, updated by ``update`` and
+    eviction. An embedding failure counts as a miss.
+    """
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS llm_cache ('
+        'key TEXT PRIMARY KEY, llm_hash TEXT, generations TEXT, embedding BLOB, tokens INTEGER, accessed_at REAL)',
+        'CREATE INDEX IF NOT EXISTS llm_cache_llm ON llm_cache (llm_hash)',
+        'CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)',
+    ]
+
+    def __init__(self, path: Optional[Path] = None, max_entries: int = None, embeddings: Optional[Embeddings] = None,
+                 similarity: float = None):
+        super().__init__(path or settings.DATA_DIR / settings.LLM_CACHE_FILE)
+        self.max_entries = max_entries or settings.LLM_CACHE_MAX_ENTRIES
+        self.embeddings = embeddings
+        self.similarity = similarity or settings.LLM_CACHE_SIMILARITY
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        # lookup未命中时算出的向量，留给随后的update复用
+        self._vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._indexes: Dict[str, SimilarityIndex] = {}
+
+    @staticmethod
+    def _group(llm_string: str, context: str) -> str:
+        return _sha256(llm_string + '\0' + context)
+
+    def _embed(self, key: str, text: str) -> np.ndarray:
+        vector = self._vectors.get(key)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+            with self._lock:
+                self._vectors[key] = vector
+                while len(self._vectors) > PENDING_VECTORS:
+                    self._vectors.popitem(last=False)
+        return vector
+
+    def _index(self, group: str, dim: int) -> SimilarityIndex:
+        """In-memory index of a group's embeddings, loaded on first use; caller holds the lock."""
+        index = self._indexes.get(group)
+        if index is None:
+            index = self._indexes[group] = SimilarityIndex(dim)
+            for key, embedding in self.conn.execute(
+                'SELECT key, embedding FROM llm_cache WHERE llm_hash = ? AND embedding IS NOT NULL', (group,)
+            ):
+                index.add(key, np.frombuffer(embedding, dtype=np.float32))
+        return index
+
+    def _semantic_lookup(self, key: str, llm_string: str, prompt: str) -> Optional[Tuple[str, str, int]]:
+        context, text = semantic_parts(prompt)
+        vector = self._embed(key, text)
+        with self._lock:
+            best, score = self._index(self._group(llm_string, context), len(vector)).nearest(vector)
+            if best is None or score < self.similarity:
+                return
+            # 命中后不会再调用update，向量在此释放
+            self._vectors.pop(key, None)
+            return self.conn.execute('SELECT key, generations, tokens FROM llm_cache WHERE key = ?', (best,)).fetchone()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        llm_hash = _sha256(llm_string)
+        key = _sha256(llm_hash + prompt)
+        with self._lock:
+            row = self.conn.execute('SELECT key, generations, tokens FROM llm_cache WHERE key = ?', (key,)).fetchone()
+        if row is None and self.embeddings is not None:
+            try:
+                row = self._semantic_lookup(key, llm_string, prompt)
+            except Exception as e:
+                # 向量服务不可用时按未命中处理
+                logger.warning(f"Semantic cache lookup failed: {e!r}")
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                metrics.incr('cache_misses', cache='llm')
+                return
+            self.hits += 1
+            self.tokens_saved += row[2] or 0
+            metrics.incr('cache_hits', cache='llm')
+            metrics.incr('llm_tokens_saved', row[2] or 0)
+            self.conn.execute('UPDATE llm_cache SET accessed_at = ? WHERE key = ?', (time.time(), row[0]))
+        return [loads(generation) for generation in json.loads(row[1])]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        llm_hash = _sha256(llm_string)
+        key = _sha256(llm_hash + prompt)
+        group, vector = llm_hash, None
+        if self.embeddings is not None:
+            context, text = semantic_parts(prompt)
+            group = self._group(llm_string, context)
+            try:
+                vector = self._embed(key, text)
+            except Exception as e:
+                logger.warning(f"Semantic cache embedding failed: {e!r}")
+        generations = json.dumps([dumps(generation) for generation in return_val])
+        with self._lock:
+            self._vectors.pop(key, None)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)',
+                (key, group, generations, None if vector is None else vector.tobytes(), _total_tokens(return_val),
+                 time.time())
+            )
+            if vector is not None and group in self._indexes:
+                self._indexes[group].add(key, vector)
+            count = self.conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+            if count > self.max_entries:
+                evicted = self.conn.execute(
+                    'SELECT key, llm_hash FROM llm_cache ORDER BY accessed_at LIMIT ?', (count - self.max_entries,)
+                ).fetchall()
+                self.conn.executemany('DELETE FROM llm_cache WHERE key = ?', [(k,) for k, _ in evicted])
+                for evicted_key, evicted_hash in evicted:
+                    if evicted_hash in self._indexes:
+                        self._indexes[evicted_hash].remove(evicted_key)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self.conn.execute('DELETE FROM llm_cache')
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'tokens_saved': self.tokens_saved,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class EmbeddingCache(SQLiteCache):
+    """Persistent embedding vectors keyed by hash(model, text), so unchanged content is never embedded twice."""
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, vector BLOB, accessed_at REAL)',
+    ]
+
+    def __init__(self, path: Optional[Path] = None):
+        super().__init__(path or settings.DATA_DIR / settings.EMBEDDING_CACHE_FILE)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return _sha256(model + '\0' + text)
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            # SQLite参数个数有上限，分批查询
+            for start in range(0, len(keys), 500):
+                batch = list(keys[start:start + 500])
+                rows = self.conn.execute(
+                    f'SELECT key, vector FROM embedding_cache WHERE key IN ({",".join("?" * len(batch))})', batch
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            if found:
+                self.conn.executemany(
+                    'UPDATE embedding_cache SET accessed_at = ? WHERE key = ?', [(time.time(), k) for k in found]
+                )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        metrics.incr('cache_hits', len(found), cache='embedding')
+        metrics.incr('cache_misses', len(keys) - len(found), cache='embedding')
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?)',
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+            )
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+fetch_cache = FetchCache()
+llm_cache = LLMCache()
+embedding_cache = EmbeddingCache()
+search_cache = MemoCache('search', ttl=settings.SEARCH_CACHE_TTL, maxsize=settings.SEARCH_CACHE_MAX_SIZE)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from documents import Node, Tree
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Append-only JSON lines log of a crawl tree.
+
+    Records are ``{"t": "n", "id", "p", "d"}`` for an added node (``d`` is the query string or
+    ``{"c": page_content, "m": metadata, "k": tokens}``), ``{"t": "x", "id", "s"}`` for an expanded node with its
+    reader score and ``{"t": "d", "id"}`` for a deleted one. Counters, dedup state and the frontier are rebuilt by
+    replaying the log, so nothing is ever rewritten.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._ids: Dict[int, int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _write(self, records: List[dict]):
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records))
+            self._file.flush()
+
+    def _register(self, node: 'Node') -> int:
+        node_id = self._ids[id(node)] = self._next_id
+        self._next_id += 1
+        return node_id
+
+    def nodes(self, parent: 'Node', nodes: List['Node']):
+        from documents import Document
+        records = []
+        for node in nodes:
+            data = node.data
+            if isinstance(data, Document):
+                data = {'c': data.page_content, 'm': data.metadata, 'k': data.tokens}
+            parent_id = self._ids[id(parent)] if parent is not None else None
+            records.append({'t': 'n', 'id': self._register(node), 'p': parent_id, 'd': data})
+        if records:
+            self._write(records)
+
+    def expanded(self, node: 'Node'):
+        self._write([{'t': 'x', 'id': self._ids[id(node)], 's': node.score}])
+
+    def deleted(self, node: 'Node'):
+        self._write([{'t': 'd', 'id': self._ids[id(node)]}])
+
+    def restore(self, tree: 'Tree') -> bool:
+        """Rebuild tree from the log; returns False when there is nothing to resume from."""
+        from documents import Document
+        if not self.path.exists() or not self.path.stat().st_size:
+            return False
+        nodes: Dict[int, 'Node'] = {}
+        pending: Dict[int, 'Node'] = {}
+        good = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('missing newline')
+                    record = json.loads(line)
+                except ValueError:
+                    # 中断时写了一半的最后一行
+                    logger.warning(f"Skip truncated checkpoint record in {self.path}")
+                    break
+                good += len(line)
+                node_id = record['id']
+                if record['t'] == 'n':
+                    if record['p'] is None:
+                        node = tree.root
+                        self._ids[id(node)] = node_id
+                    else:
+                        data = record['d']
+                        if isinstance(data, dict):
+                            data = Document(page_content=data['c'], metadata=data['m'], tokens=data['k'])
+                        node = tree.restore_node(nodes[record['p']], data)
+                        self._ids[id(node)] = node_id
+                    nodes[node_id] = pending[node_id] = node
+                    self._next_id = max(self._next_id, node_id + 1)
+                elif record['t'] == 'x':
+                    nodes[node_id].score = record.get('s')
+                    pending.pop(node_id, None)
+                elif record['t'] == 'd':
+                    nodes[node_id].delete()
+                    pending.pop(node_id, None)
+        if good < self.path.stat().st_size:
+            # 截掉残缺部分，否则后续追加的记录会接在残行后面
+            with open(self.path, 'r+b') as f:
+                f.truncate(good)
+        if not nodes:
+            return False
+        tree.leaf_nodes.extend(pending.values())
+        logger.info(f"Resumed {len(nodes)} nodes ({len(pending)} in frontier) from {self.path}")
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
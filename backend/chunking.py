@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Token-sized chunking of crawled documents, streamed to JSONL as documents arrive.
+
+Two files are written side by side::
+
+    <name>.documents.jsonl  {"id", "source", "title", "type", "summary", "keywords", "query"}  one line per document
+    <name>.chunks.jsonl     {"doc_id", "index", "text", "tokens"}                             one line per chunk
+
+Chunks reference their document by id, so metadata is stored once however many chunks a document has.
+"""
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Union
+
+import settings
+from documents import Document, get_encoding
+from utils import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# HTML块级标签优先，其次段落/换行，最后中英文句末标点
+SEPARATORS = ['<h', '<p', '<li', '<tr', '\n\n', '\n', '\r', '......', '。', '！', '？', '!', '?', '.', '；', ';', '##', ' ']
+
+
+def document_id(doc: Document) -> str:
+    source = doc.metadata.get('source')
+    key = normalize_url(source) if source else doc.metadata.get('content') or doc.page_content
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ChunkSplitter:
+    """Splits text on SEPARATORS into chunks of at most chunk_tokens tokens of the given model's encoding."""
+
+    def __init__(self, chunk_tokens: int = None, chunk_overlap: int = None, model: str = 'gpt-3.5-turbo'):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        encoding = get_encoding(model)
+        self.encoding = encoding
+        self.splitter = RecursiveCharacterTextSplitter(
+            separators=SEPARATORS,
+            chunk_size=chunk_tokens or settings.CHUNK_TOKENS,
+            chunk_overlap=settings.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap,
+            length_function=lambda text: len(encoding.encode(text, disallowed_special=())),
+            keep_separator=True,
+        )
+
+    def split(self, text: str) -> List[str]:
+        return [chunk for chunk in self.splitter.split_text(text) if chunk.strip()]
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+class ChunkWriter:
+    """Appends documents and their chunks to JSONL as they come in; documents already written are skipped.
+
+    ``write`` chunks on the calling thread, ``add`` on a background thread. The files are opened on the first write
+    and reopened after ``close``, so one writer can serve several crawls.
+    """
+
+    def __init__(self, path: Union[str, Path], splitter: Optional[ChunkSplitter] = None):
+        path = Path(path)
+        self.documents_path = path.with_suffix('.documents.jsonl')
+        self.chunks_path = path.with_suffix('.chunks.jsonl')
+        self.splitter = splitter or ChunkSplitter()
+        self.seen: Set[str] = set()
+        self.chunks = 0
+        self._lock = threading.Lock()
+        # 续写已有文件时跳过已切分的文档
+        if self.documents_path.exists():
+            with open(self.documents_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.seen.add(json.loads(line)['id'])
+                    except (ValueError, KeyError):
+                        # 进程中断留下的不完整行
+                        continue
+        self._documents = None
+        self._chunks = None
+        # 单线程保证写入顺序，切分（分词）不占用爬取的结果回收线程
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def write(self, doc: Document) -> int:
+        """Chunk one document and append it; returns the number of chunks written."""
+        doc_id = document_id(doc)
+        with self._lock:
+            if doc_id in self.seen:
+                return 0
+            self.seen.add(doc_id)
+        metadata = doc.metadata
+        text = metadata.get('content') or doc.page_content
+        # 切分在锁外进行，写入时才加锁
+        chunks = self.splitter.split(text)
+        record = {k: metadata.get(k) for k in ('source', 'title', 'type', 'summary', 'keywords', 'query')}
+        lines = [
+            json.dumps({'doc_id': doc_id, 'index': i, 'text': chunk, 'tokens': self.splitter.count(chunk)},
+                       ensure_ascii=False)
+            for i, chunk in enumerate(chunks)
+        ]
+        with self._lock:
+            if self._documents is None:
+                self._documents = open(self.documents_path, 'a', encoding='utf-8')
+                self._chunks = open(self.chunks_path, 'a', encoding='utf-8')
+            self._documents.write(json.dumps({'id': doc_id, **record}, ensure_ascii=False) + '\n')
+            if lines:
+                self._chunks.write('\n'.join(lines) + '\n')
+            self.chunks += len(lines)
+        return len(lines)
+
+    def _write_logged(self, doc: Document):
+        try:
+            self.write(doc)
+        except Exception as e:
+            logger.warning(f"Chunking failed: source={doc.metadata.get('source')} {e!r}")
+
+    def add(self, doc: Document):
+        """Chunk and write doc on the background thread; failures are logged, not raised."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chunker')
+        self._executor.submit(self._write_logged, doc)
+
+    def flush(self):
+        """Wait for documents queued by add, then flush the files."""
+        if self._executor is not None:
+            # 单线程按提交顺序执行，空任务完成即之前的文档都已写入
+            self._executor.submit(lambda: None).result()
+        with self._lock:
+            if self._documents is not None:
+                self._chunks.flush()
+                self._documents.flush()
+
+    def close(self):
+        """Flush, stop the background thread and close the files."""
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._lock:
+            if self._documents is not None:
+                self._chunks.close()
+                self._documents.close()
+                self._documents = self._chunks = None
+
+    def __enter__(self) -> 'ChunkWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def split_large_chunk_and_save(docs: Iterable[Document], path: Union[str, Path], chunk_tokens: int = None,
+                               chunk_overlap: int = None, model: str = 'gpt-3.5-turbo') -> int:
+    """Chunk docs into the JSONL pair at path as they are produced; pass ``loader.lazy_load()`` to chunk while
+    crawling. Returns the number of chunks written."""
+    with ChunkWriter(path, ChunkSplitter(chunk_tokens, chunk_overlap, model)) as writer:
+        for doc in docs:
+            writer.write(doc)
+        return writer.chunks
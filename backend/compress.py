@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import html
+import re
+from collections import Counter
+from typing import List, Iterable
+
+import settings
+from dedup import tokenize
+from documents import Document, get_encoding
+from metrics import metrics
+from relevance import BM25
+
+BLOCK_TAG_RE = re.compile(r'<\s*/?\s*(?:p|div|br|h[1-6]|li|ul|ol|tr|table|section|article|blockquote|pre)\b[^>]*>', re.I)
+TAG_RE = re.compile(r'<[^>]+>')
+SPACE_RE = re.compile(r'[ \t\r\f\v]+')
+# 句末标点之后或换行处断句
+SENTENCE_RE = re.compile(r'[^\n.!?。！？；;]+(?:[.!?。！？；;]+|\n|$)')
+LEAD_BONUS = 0.1
+
+
+def html_to_text(text: str) -> str:
+    """Strip tags, keeping block boundaries as newlines."""
+    if '<' not in text:
+        return text
+    text = TAG_RE.sub(' ', BLOCK_TAG_RE.sub('\n', text))
+    lines = (SPACE_RE.sub(' ', line).strip() for line in html.unescape(text).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_RE.findall(text) if s.strip()]
+
+
+class Compressor:
+    """Extractive compression: keeps the sentences that best match the query terms, in original order, until the
+    token budget of the given model's encoding is spent."""
+
+    def __init__(self, budget: int = None, model: str = 'gpt-3.5-turbo'):
+        self.budget = budget or settings.READER_INPUT_TOKENS
+        self.encoding = get_encoding(model)
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def compress(self, text: str, terms: Iterable[str], budget: int = None) -> str:
+        budget = self.budget if budget is None else budget
+        text = html_to_text(text)
+        sentences = split_sentences(text)
+        if not sentences:
+            return text
+        lengths = [len(tokens) for tokens in self.encoding.encode_batch(sentences, disallowed_special=())]
+        if sum(lengths) <= budget:
+            return text
+        # 以句子为语料计算BM25，开头的句子略加分
+        bm25 = BM25()
+        counts = []
+        for sentence in sentences:
+            tokens = tokenize(sentence)
+            counts.append((Counter(tokens), len(tokens)))
+            bm25.add(*counts[-1])
+        terms = set(terms)
+        scores = [
+            bm25.score(terms, c, n) + LEAD_BONUS * (1 - i / len(sentences))
+            for i, (c, n) in enumerate(counts)
+        ]
+        selected, used = [], 0
+        for i in sorted(range(len(sentences)), key=lambda i: -scores[i]):
+            if used + lengths[i] <= budget:
+                selected.append(i)
+                used += lengths[i]
+            elif not selected:
+                # 单句就超出预算时按token截断
+                selected.append(i)
+                sentences[i] = self.encoding.decode(
+                    self.encoding.encode(sentences[i], disallowed_special=())[:budget]
+                )
+                break
+        return ' '.join(sentences[i] for i in sorted(selected))
+
+    def reader_input(self, doc: Document, topic: str, budget: int = None) -> str:
+        """Plain-text reader prompt body for doc, drawn from its full content rather than the truncated
+        page_content, header included within the token budget."""
+        metadata = doc.metadata
+        terms = tokenize(topic) + tokenize(metadata.get('query') or '')
+        header = '\n'.join(f'{k}: {metadata[k]}' for k in ('title', 'source') if metadata.get(k))
+        budget = (self.budget if budget is None else budget) - (self.count(header) + 1 if header else 0)
+        with metrics.span('compress'):
+            body = self.compress(metadata.get('content') or doc.page_content, terms, max(budget, 1))
+        return f'{header}\n{body}' if header else body
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import re
+from typing import Dict, List, Set, Optional
+
+from utils import normalize_url, normalize_query
+
+TOKEN_RE = re.compile(r'[぀-ヿ㐀-鿿가-힯]|\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; CJK text is split per character."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def _hash64(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'big')
+
+
+def simhash(text: str, shingle_size: int = 2, bits: int = 64) -> int:
+    tokens = tokenize(text)
+    shingles = [' '.join(tokens[i:i + shingle_size]) for i in range(max(len(tokens) - shingle_size + 1, 1))]
+    weights = [0] * bits
+    for shingle in shingles:
+        h = _hash64(shingle)
+        for i in range(bits):
+            weights[i] += 1 if h >> i & 1 else -1
+    return sum(1 << i for i, w in enumerate(weights) if w > 0)
+
+
+class DedupIndex:
+    """Exact dedup on canonical source url plus SimHash near-duplicate detection with a banded LSH index.
+
+    With ``bands`` > ``max_distance`` any two fingerprints within ``max_distance`` bits share at least one
+    band, so the band buckets never miss a near-duplicate.
+    """
+
+    def __init__(self, bands: int = 8, max_distance: int = 7, bits: int = 64):
+        assert bands > max_distance
+        self.bands = bands
+        self.max_distance = max_distance
+        self.band_bits = bits // bands
+        self.sources: Set[str] = set()
+        self.fingerprints: List[int] = []
+        self.buckets: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+        self.duplicates = 0
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [fingerprint >> (i * self.band_bits) & mask for i in range(self.bands)]
+
+    def is_near_duplicate(self, fingerprint: int) -> bool:
+        for bucket, key in zip(self.buckets, self._band_keys(fingerprint)):
+            for idx in bucket.get(key, ()):
+                if bin(self.fingerprints[idx] ^ fingerprint).count('1') <= self.max_distance:
+                    return True
+        return False
+
+    def add(self, source: str, text: str) -> bool:
+        """Index a document; returns False (and indexes nothing) if it is a duplicate."""
+        source = normalize_url(source) if source else None
+        fingerprint = simhash(text)
+        if (source and source in self.sources) or self.is_near_duplicate(fingerprint):
+            self.duplicates += 1
+            return False
+        if source:
+            self.sources.add(source)
+        idx = len(self.fingerprints)
+        self.fingerprints.append(fingerprint)
+        for bucket, key in zip(self.buckets, self._band_keys(fingerprint)):
+            bucket.setdefault(key, []).append(idx)
+        return True
+
+
+def char_ngrams(text: str, n: int = 3) -> Set[str]:
+    text = f' {text} '
+    return {text[i:i + n] for i in range(max(len(text) - n + 1, 1))}
+
+
+class QueryIndex:
+    """Seen/queued search queries, matched by normalized form, bag of words and character trigram Jaccard.
+
+    A new query at least ``similarity`` similar to an indexed one is reported as a duplicate of it, so paraphrases
+    like "AI agent frameworks" / "Frameworks, AI agent" collapse onto the first query.
+    """
+
+    def __init__(self, similarity: float = 0.75, n: int = 3):
+        self.similarity = similarity
+        self.n = n
+        self.queries: List[str] = []
+        self.grams: List[Set[str]] = []
+        self.exact: Dict[str, int] = {}
+        self.postings: Dict[str, List[int]] = {}
+        self.merged: Dict[int, List[str]] = {}
+        self.duplicates = 0
+
+    @staticmethod
+    def _keys(normalized: str) -> List[str]:
+        # 归一化形式、词袋形式（忽略词序）与去空格形式（中文分词差异）
+        return [normalized, ' '.join(sorted(set(normalized.split()))), normalized.replace(' ', '')]
+
+    def find(self, query: str) -> Optional[int]:
+        """Index of the indexed query that query duplicates, if any."""
+        normalized = normalize_query(query)
+        for key in self._keys(normalized):
+            if key in self.exact:
+                return self.exact[key]
+        grams = char_ngrams(normalized, self.n)
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for idx in self.postings.get(gram, ()):
+                shared[idx] = shared.get(idx, 0) + 1
+        best, best_score = None, self.similarity
+        for idx, count in shared.items():
+            score = count / (len(grams) + len(self.grams[idx]) - count)
+            if score >= best_score:
+                best, best_score = idx, score
+        return best
+
+    def add(self, query: str) -> bool:
+        """Index a query; returns False (recording it as merged into the match) if it is a duplicate."""
+        idx = self.find(query)
+        if idx is not None:
+            self.duplicates += 1
+            self.merged.setdefault(idx, []).append(query)
+            return False
+        normalized = normalize_query(query)
+        idx = len(self.queries)
+        self.queries.append(query)
+        self.grams.append(char_ngrams(normalized, self.n))
+        for key in self._keys(normalized):
+            self.exact.setdefault(key, idx)
+        for gram in self.grams[idx]:
+            self.postings.setdefault(gram, []).append(idx)
+        return True
@@ -1,16 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from collections import deque
-from dataclasses import dataclass, field
-from typing import TypedDict, List, Literal, Union, Optional, Dict, Sequence, Any
+import functools
+import json
+import os
+import tempfile
+import threading
+from dataclasses import field
+from pathlib import Path
+from typing import TypedDict, List, Literal, Union, Optional, Dict, Sequence, Any, Iterator
 
 import tiktoken
 from langchain_core.documents import Document as LangchainDocument
-from pydantic import BaseModel, PrivateAttr
+from pydantic import BaseModel, PrivateAttr, ConfigDict
 from pydantic.v1 import root_validator, Field
 from tiktoken import Encoding
 
 import settings
+from checkpoint import Checkpoint
+from dedup import DedupIndex, QueryIndex
+from metrics import metrics
+from scheduler import Frontier
 
 
 class Metadata(TypedDict):
@@ -23,9 +32,17 @@ class Metadata(TypedDict):
     query: str
 
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> Encoding:
+    """tiktoken encoding for model, loaded once per process and shared."""
+    return tiktoken.encoding_for_model(model)
+
+
 class Document(LangchainDocument):
     metadata: Metadata
     page_content: Any
+    tokens: Optional[int] = None
+    relevance: Optional[float] = None
 
     @classmethod
     def create(cls, metadata: Metadata, page_content=None):
@@ -44,66 +61,234 @@ Query = str
 NodeDataType = Union[Document, Query]
 
 
-@dataclass
+class DocumentStore:
+    """Append-only file of serialized documents; nodes keep only (offset, length) into it."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self._file = open(path, 'w+b') if path else tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+
+    def put(self, document: Document) -> 'SpilledDocument':
+        raw = json.dumps(
+            {'page_content': document.page_content, 'metadata': document.metadata}, ensure_ascii=False
+        ).encode()
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(raw)
+        return SpilledDocument(self, offset, len(raw), document.tokens)
+
+    def get(self, ref: 'SpilledDocument') -> Document:
+        with self._lock:
+            self._file.seek(ref.offset)
+            raw = self._file.read(ref.length)
+        return Document(**json.loads(raw), tokens=ref.tokens)
+
+
+class SpilledDocument:
+    __slots__ = ('store', 'offset', 'length', 'tokens')
+
+    def __init__(self, store: DocumentStore, offset: int, length: int, tokens: Optional[int]):
+        self.store = store
+        self.offset = offset
+        self.length = length
+        self.tokens = tokens
+
+    def load(self) -> Document:
+        return self.store.get(self)
+
+
 class Node:
-    data: NodeDataType
-    parent: Optional['Node'] = None
-    child_nodes: List['Node'] = field(default_factory=list)
-    deleted: bool = False
+    __slots__ = ('_data', 'parent', 'child_nodes', 'deleted', 'depth', 'score')
+
+    def __init__(self, data: NodeDataType, parent: Optional['Node'] = None, child_nodes: Sequence['Node'] = (),
+                 deleted: bool = False, depth: int = 0, score: Optional[float] = None):
+        self._data: Union[NodeDataType, SpilledDocument] = data
+        self.parent = parent
+        # 叶子节点共享空tuple，添加子节点时才分配list
+        self.child_nodes: Sequence['Node'] = child_nodes
+        self.deleted = deleted
+        self.depth = depth
+        self.score = score
+
+    def __repr__(self):
+        return f'Node(node_type={self.node_type!r}, depth={self.depth}, children={len(self.child_nodes)})'
+
+    @property
+    def data(self) -> NodeDataType:
+        if isinstance(self._data, SpilledDocument):
+            return self._data.load()
+        return self._data
+
+    @data.setter
+    def data(self, value: NodeDataType):
+        self._data = value
 
     @property
     def node_type(self) -> Literal['Document', 'Query']:
-        if isinstance(self.data, Document):
+        if isinstance(self._data, (Document, SpilledDocument)):
             return 'Document'
         return 'Query'
 
-    def add_child_nodes(self, dataset: List[NodeDataType]):
+    @property
+    def tokens(self) -> int:
+        if isinstance(self._data, (Document, SpilledDocument)):
+            return self._data.tokens or 0
+        return 0
+
+    def add_child_nodes(self, dataset: List[NodeDataType]) -> List['Node']:
         nodes = []
         for data in dataset:
-            nodes.append(Node(data=data, parent=self))
-        self.child_nodes.extend(nodes)
+            nodes.append(Node(data=data, parent=self, depth=self.depth + 1))
+        if isinstance(self.child_nodes, list):
+            self.child_nodes.extend(nodes)
+        else:
+            self.child_nodes = list(nodes)
+        return nodes
+
+    def iter_nodes(self) -> Iterator['Node']:
+        """Pre-order traversal with an explicit stack, safe for arbitrarily deep query chains."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.child_nodes))
 
     def all_nodes(self) -> List['Node']:
-        nodes = [self]
-        for node in self.child_nodes:
-            nodes.extend(node.all_nodes())
-        return nodes
+        return list(self.iter_nodes())
+
+    def iter_documents(self) -> Iterator[Document]:
+        for node in self.iter_nodes():
+            if node.node_type == 'Document' and node.deleted is False:
+                yield node.data
 
     def all_documents(self) -> List[Document]:
-        nodes = self.all_nodes()
-        return [node.data for node in nodes if node.node_type == 'Document' and node.deleted is False]
+        return list(self.iter_documents())
 
     def delete(self):
         self.deleted = True
 
+    def spill(self, store: DocumentStore):
+        """Move the document body to store, keeping only its offset in memory."""
+        if isinstance(self._data, Document):
+            self._data = store.put(self._data)
+
+    def release(self):
+        """Drop the document body, keeping a skeleton with its identifying metadata and token count."""
+        if self.node_type == 'Document':
+            data = self.data
+            # Metadata的键均为必填，正文相关字段置空
+            metadata = Metadata(
+                content='', summary='', keywords='', type=data.metadata.get('type'),
+                **{k: data.metadata.get(k) or '' for k in ('title', 'source', 'query')}
+            )
+            self._data = Document(metadata=metadata, page_content='', tokens=data.tokens)
+
 
 class Tree(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     root: 'Node'
     tokens: int = field(default=0)
-    leaf_nodes: deque[Node] = field(default_factory=deque)
+    leaf_nodes: Frontier = field(default_factory=Frontier)
     doc_node_num: int = field(default=0)
     embedding_model: str = 'gpt-3.5-turbo'
+    spill_documents: bool = False
+    checkpoint_path: Optional[Path] = None
     _encoding: Optional[Encoding] = PrivateAttr(None)
+    _dedup: DedupIndex = PrivateAttr(default_factory=DedupIndex)
+    _queries: QueryIndex = PrivateAttr(default_factory=QueryIndex)
+    _store: Optional[DocumentStore] = PrivateAttr(None)
+    _checkpoint: Optional[Checkpoint] = PrivateAttr(None)
 
     def model_post_init(self, __context) -> None:
-        self._encoding = tiktoken.encoding_for_model(self.embedding_model)
+        self._encoding = get_encoding(self.embedding_model)
+        self._queries.add(self.root.data)
+        if self.spill_documents:
+            self._store = DocumentStore()
+        if self.checkpoint_path:
+            self._checkpoint = Checkpoint(self.checkpoint_path)
+            if self._checkpoint.restore(self):
+                return
+            self._checkpoint.nodes(None, [self.root])
+        if not self.leaf_nodes and not self.root.child_nodes:
+            self.leaf_nodes.push(self.root)
+
+    def count_tokens(self, documents: List[Document]) -> List[int]:
+        """Token count of each document, encoding only the ones not counted yet and caching the result on them."""
+        pending = [doc for doc in documents if doc.tokens is None]
+        if pending:
+            with metrics.span('tokenize'):
+                encoded = self._encoding.encode_batch([doc.page_content for doc in pending], disallowed_special=())
+            for doc, tokens in zip(pending, encoded):
+                doc.tokens = len(tokens)
+        return [doc.tokens for doc in documents]
 
-    def add_nodes(self, parent: Node, dataset: List[NodeDataType]):
-        if not isinstance(dataset, Sequence):
+    def _is_new(self, data: NodeDataType) -> bool:
+        if isinstance(data, Document):
+            # 丢弃重复文档（同源或近似内容），不计入文档数与token
+            return self._dedup.add(data.metadata.get('source'), data.page_content)
+        # 与已有query近似的合并到该节点，不再新开分支
+        return self._queries.add(data)
+
+    def add_nodes(self, parent: Node, dataset: List[NodeDataType]) -> List[Node]:
+        if isinstance(dataset, str) or not isinstance(dataset, Sequence):
             dataset = [dataset]
-        parent.add_child_nodes(dataset=dataset)
+        dataset = [data for data in dataset if self._is_new(data)]
+        nodes = parent.add_child_nodes(dataset=dataset)
         documents = [data for data in dataset if isinstance(data, Document)]
         if documents:
-            self.leaf_nodes.extendleft(parent.child_nodes)
             self.doc_node_num += len(documents)
-            doc_texts = ''.join(doc.page_content for doc in documents)
-            self.tokens += len(self._encoding.encode(doc_texts))
+            self.tokens += sum(self.count_tokens(documents))
+        if self._checkpoint:
+            self._checkpoint.nodes(parent, nodes)
+        self.leaf_nodes.extend(nodes)
+        if self._store:
+            # 入队评分后正文写入磁盘，读取时按偏移加载
+            for node in nodes:
+                node.spill(self._store)
+        return nodes
+
+    def restore_node(self, parent: Node, data: NodeDataType) -> Node:
+        """Re-add a checkpointed node, rebuilding counters and dedup state without enqueuing or logging it."""
+        node, = parent.add_child_nodes([data])
+        if not isinstance(data, Document):
+            self._queries.add(data)
         else:
-            # 右端优先被处理
-            self.leaf_nodes.extend(parent.child_nodes)
+            self._dedup.add(data.metadata.get('source'), data.page_content)
+            self.doc_node_num += 1
+            self.tokens += self.count_tokens([data])[0]
+            if self._store:
+                node.spill(self._store)
+        return node
+
+    def mark_expanded(self, node: Node):
+        if self._checkpoint:
+            self._checkpoint.expanded(node)
+
+    def delete_node(self, node: Node):
+        node.delete()
+        if self._checkpoint:
+            self._checkpoint.deleted(node)
+
+    def close(self):
+        """Close the checkpoint log; the next write reopens it."""
+        if self._checkpoint:
+            self._checkpoint.close()
+
+    @property
+    def duplicates(self) -> int:
+        return self._dedup.duplicates
+
+    @property
+    def merged_queries(self) -> int:
+        return self._queries.duplicates
 
     def all_nodes(self):
         return self.root.all_nodes()
 
+    def iter_documents(self) -> Iterator[Document]:
+        return self.root.iter_documents()
+
     def all_documents(self) -> List[Document]:
         return self.root.all_documents()
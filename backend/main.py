@@ -1,23 +1,45 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import asyncio
 import functools
 import logging
 import math
-from typing import List, Sequence, TypedDict, Optional, Literal
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from queue import Queue
+from typing import List, Sequence, TypedDict, Optional, Literal, Deque, Tuple, Callable, Iterator, AsyncIterator, Union
 from langchain_core.documents import Document
 from langchain_core.document_loaders import BaseLoader
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.tools import BaseTool
-from langchain_openai import ChatOpenAI
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 import settings
-from agents.factory import create_searcher, load_reading_tools, load_searching_tools, create_reader
+from cache import fetch_cache, search_cache, llm_cache, embedding_cache, LLMCache
+from chunking import ChunkWriter, ChunkSplitter
+from vectors import VectorIndex, CachedEmbeddings, DocumentIndexer
+from relevance import RelevanceFilter, relevance_scorer
+from compress import Compressor
+from agents.factory import create_searcher, load_searching_tools, create_reader
+from agents.tools.parsers import ReadingResult, ReadingResults
 from documents import Node, Tree, NodeDataType
+from metrics import metrics, MetricsCallbackHandler
+from scheduler import Frontier, FairBudget
 
 logger = logging.getLogger(__name__)
 
 
+def validate_reading(result) -> ReadingResult:
+    """Check one parsed reader entry; fields the model left out count as empty, anything malformed raises
+    ValueError."""
+    if not isinstance(result, dict):
+        raise ValueError(f'Reader returned {type(result).__name__}, expected an object')
+    return ReadingResult.model_validate(
+        {'next_search_queries': [], 'valuable_links': [], 'score_list': [], 'summary': '', **result}
+    )
+
+
 class ConfigDict(TypedDict):
     max_documents: float
     max_tokens: int
@@ -27,72 +49,351 @@ class ConfigDict(TypedDict):
     searcher_prompt: str
     search_engine: Literal['google', 'bing', 'duckduckgo']
     openai_api_key: str
+    max_workers: int
+    frontier_policy: Literal['bfs', 'dfs', 'best']
+    reader_batch_size: int
+    reader_pack_tokens: int
+    reader_max_concurrency: int
+    release_emitted: bool
+    spill_documents: bool
+    checkpoint_path: str
+    llm_cache: Optional[Literal['exact', 'semantic']]
+    chunk_path: str
+    chunk_tokens: int
+    chunk_overlap: int
+    index_path: str
+    relevance_threshold: float
+    relevance_action: Literal['prune', 'deprioritize']
+    reader_input_tokens: int
 
 
 class SearchLoader(BaseLoader):
-    def __init__(self, topic: str, config: Optional[ConfigDict] = None, llm: Optional[BaseLanguageModel] = None):
+    def __init__(self, topic: str, config: Optional[ConfigDict] = None, llm: Optional[BaseLanguageModel] = None,
+                 budget: Optional[FairBudget] = None, job_id: Optional[str] = None):
         config = config or {}
         self.topic = topic.replace('\n', ' ')
+        # 多个爬取任务共享的全局并发额度
+        self.budget = budget
+        self.job_id = job_id or self.topic
         self.docs = []
-        self.tree = Tree(root=Node(data=self.topic, parent=None), embedding_model=config.get('embedding_model') or 'text-embedding-ada-002')
+        # 阅读前的词法预筛选，阈值为0时关闭
+        threshold = config.get('relevance_threshold', settings.RELEVANCE_THRESHOLD)
+        self.relevance = RelevanceFilter(
+            self.topic, threshold, config.get('relevance_action')
+        ) if threshold else None
+        self.tree = Tree(
+            root=Node(data=self.topic, parent=None),
+            leaf_nodes=Frontier(
+                policy=config.get('frontier_policy') or settings.FRONTIER_POLICY,
+                scorer=relevance_scorer(self.relevance)
+            ),
+            embedding_model=config.get('embedding_model') or 'text-embedding-ada-002',
+            spill_documents=config.get('spill_documents', False),
+            checkpoint_path=config.get('checkpoint_path')
+        )
         self.reader_prompt = config.get('reader_prompt') or settings.READER_PROMPT
         self.searcher_prompt = config.get('searcher_prompt') or settings.SEARCHER_PROMPT
         self.max_documents = config.get('max_documents') or math.inf
         self.max_tokens = config.get('max_tokens') or math.inf
+        self.max_workers = config.get('max_workers') or settings.MAX_WORKERS
+        self.reader_batch_size = config.get('reader_batch_size') or settings.READER_BATCH_SIZE
+        self.reader_pack_tokens = config.get('reader_pack_tokens') or settings.READER_PACK_TOKENS
+        self.reader_max_concurrency = config.get('reader_max_concurrency') or settings.READER_MAX_CONCURRENCY
+        self.release_emitted = config.get('release_emitted', False)
+        self.chunk_writer = ChunkWriter(config['chunk_path'], ChunkSplitter(
+            config.get('chunk_tokens'), config.get('chunk_overlap'), self.tree.embedding_model
+        )) if config.get('chunk_path') else None
+        # 阅读前压缩为纯文本并截取相关句子，为0时直接传入Document
+        input_tokens = config.get('reader_input_tokens', settings.READER_INPUT_TOKENS)
+        self.compressor = Compressor(input_tokens, self.tree.embedding_model) if input_tokens else None
+        self.indexer = DocumentIndexer(VectorIndex(config['index_path']), CachedEmbeddings(
+            OpenAIEmbeddings(model=self.tree.embedding_model, openai_api_key=config.get('openai_api_key')),
+            self.tree.embedding_model
+        )) if config.get('index_path') else None
+        self._cancelled = threading.Event()
         self.search_tools: List[BaseTool] = load_searching_tools(
             config.get('search_engine') or settings.DEFAULT_SEARCH_ENGINE,
             config.get('num_results') or settings.NUM_RESULTS
         )
-        self.read_tools: List[BaseTool] = load_reading_tools()
-        self.llm = llm or ChatOpenAI(openai_api_key=config.get('openai_api_key'))
+        self.llm_cache = self._create_llm_cache(config.get('llm_cache', settings.LLM_CACHE), config)
+        self.llm = llm or ChatOpenAI(openai_api_key=config.get('openai_api_key'), cache=self.llm_cache)
         logger.info(f"SearchLoader initialize...")
 
+        self.report = {}
+        self._callbacks = {
+            name: [MetricsCallbackHandler(metrics, name)] if metrics.enabled else []
+            for name in ('reader', 'searcher')
+        }
         self.reader = create_reader(self.reader_prompt, self.llm)
+        self.packed_reader = create_reader(self.reader_prompt, self.llm, schema=ReadingResults)
         self.searcher = create_searcher(self.searcher_prompt, self.search_tools, self.llm)
 
-    def load(self) -> List[Document]:
-        logger.info(f"SearchLoader Start Running...")
-        while self.tree.leaf_nodes:
-            node = self.tree.leaf_nodes.pop()
+    @staticmethod
+    def _create_llm_cache(mode: Optional[str], config: ConfigDict) -> Optional[LLMCache]:
+        if mode == 'semantic':
+            return LLMCache(embeddings=OpenAIEmbeddings(
+                model=config.get('embedding_model') or 'text-embedding-ada-002',
+                openai_api_key=config.get('openai_api_key')
+            ))
+        elif mode == 'exact':
+            return llm_cache
+
+    def _search(self, nodes: List[Node]) -> List[Optional[List[NodeDataType]]]:
+        # 处理query
+        config = {'callbacks': self._callbacks['searcher']}
+        with metrics.span('searcher'):
+            return [self.searcher.invoke({'input': node.data, 'topic': self.topic}, config) for node in nodes]
 
-            if node.node_type == 'Document':
-                # 处理Document
-                agent = self.reader
-                context = node.data
+    def _pack(self, nodes: List[Node], sizes: List[int]) -> List[List[Node]]:
+        """Group consecutive short documents into one prompt while their reader inputs fit reader_pack_tokens."""
+        groups, tokens = [], 0
+        for node, size in zip(nodes, sizes):
+            if groups and tokens + size <= self.reader_pack_tokens:
+                groups[-1].append(node)
+                tokens += size
             else:
-                # 处理query
-                agent = self.searcher
-                context = node.data
-
-            dataset: Optional[List[NodeDataType]] = agent.invoke({'input': context, 'topic': self.topic})
-            for data in dataset:
-                if isinstance(data, Document):
-                    logger.info(f"New Document: source={data.source} page_content={data.page_content}")
-                else:
-                    logger.info(f"New Query: {data}")
-
-            if dataset is None:
-                # 触发stop，删除节点
-                node.delete()
+                groups.append([node])
+                tokens = size
+        return groups
+
+    def _reader_inputs(self, nodes: List[Node]) -> List[Tuple[Union[Document, str], int]]:
+        """Reader input of each node with its size in tokens: the compressed text when compression is on, otherwise
+        the document itself and its page_content tokens."""
+        if self.compressor is None:
+            return [(node.data, node.tokens) for node in nodes]
+        texts = [self.compressor.reader_input(node.data, self.topic) for node in nodes]
+        return [(text, self.compressor.count(text)) for text in texts]
+
+    @staticmethod
+    def _packed_input(inputs: List[Union[Document, str]]) -> str:
+        """Numbered documents for one packed reader call, each with the input it would get when read alone."""
+        parts = [
+            f'source: {data.metadata.get("source")}\n{data.page_content}' if isinstance(data, Document) else data
+            for data in inputs
+        ]
+        return '\n\n'.join(f'[{i}] {part}' for i, part in enumerate(parts, 1))
+
+    def _read(self, nodes: List[Node]) -> List[Union[Optional[List[NodeDataType]], Exception]]:
+        # 处理Document，评分用于调度其衍生的query；失败的节点返回异常
+        inputs = self._reader_inputs(nodes)
+        # 按实际送入reader的大小合并，每篇文档的压缩预算与单独阅读时相同
+        groups = self._pack(nodes, [size for _, size in inputs])
+        inputs = {id(node): data for node, (data, _) in zip(nodes, inputs)}
+        singles = [group for group in groups if len(group) == 1]
+        packs = [group for group in groups if len(group) > 1]
+        config = {'max_concurrency': self.reader_max_concurrency, 'callbacks': self._callbacks['reader']}
+        results = {}
+        with metrics.span('reader'):
+            if singles:
+                outputs = self.reader.batch(
+                    [{'input': inputs[id(group[0])], 'topic': self.topic} for group in singles], config,
+                    return_exceptions=True
+                )
+                for group, output in zip(singles, outputs):
+                    results[id(group[0])] = output
+            if packs:
+                outputs = self.packed_reader.batch([{
+                    'input': self._packed_input([inputs[id(node)] for node in group]),
+                    'topic': self.topic
+                } for group in packs], config, return_exceptions=True)
+                for group, output in zip(packs, outputs):
+                    if isinstance(output, Exception):
+                        output = [output] * len(group)
+                    elif not isinstance(output, dict) or not isinstance(output.get('results'), list):
+                        output = [ValueError(f'Packed reader returned {output!r:.200}, expected {{"results": [...]}}')]
+                        output *= len(group)
+                    else:
+                        output = output['results']
+                    for i, node in enumerate(group):
+                        results[id(node)] = output[i] if i < len(output) else ValueError(
+                            f'Packed reader returned {len(output)} results for {len(group)} documents'
+                        )
+
+        datasets = []
+        for node in nodes:
+            result = results[id(node)]
+            if result is None:
+                datasets.append(None)
                 continue
-            self.tree.add_nodes(node, dataset=dataset)
-            if self.tree.doc_node_num >= self.max_documents:
-                break
-            elif self.tree.tokens >= self.max_tokens:
-                break
+            if not isinstance(result, Exception):
+                try:
+                    result = validate_reading(result)
+                except ValueError as e:
+                    # 格式不符的结果按失败处理，只影响对应文档
+                    result = e
+            if isinstance(result, Exception):
+                logger.warning(f"Reader failed: source={node.data.metadata.get('source')} {result!r}")
+                metrics.incr('reader_failures')
+                datasets.append(result)
+                continue
+            if result.score_list:
+                node.score = sum(result.score_list) / len(result.score_list)
+            datasets.append(result.next_search_queries)
+        return datasets
+
+    def _run_task(self, fn: Callable[[List[Node]], List], nodes: List[Node]) -> List:
+        if self.budget is None:
+            return fn(nodes)
+        self.budget.acquire(self.job_id)
+        try:
+            return fn(nodes)
+        finally:
+            self.budget.release()
+
+    def _prefilter(self, dataset: List[NodeDataType]) -> List[NodeDataType]:
+        """Score new documents with BM25; with action 'prune' the off-topic ones never reach the tree or reader."""
+        kept = []
+        for data in dataset:
+            if isinstance(data, Document) and not self.relevance.is_relevant(data) and self.relevance.action == 'prune':
+                logger.info(f"Pruned Document: source={data.metadata.get('source')} relevance={data.relevance:.3f}")
+                continue
+            kept.append(data)
+        return kept
+
+    def _submit(self, executor: ThreadPoolExecutor) -> Tuple[List[Node], Future]:
+        node = self.tree.leaf_nodes.pop()
+        if node.node_type != 'Document':
+            return [node], executor.submit(self._run_task, self._search, [node])
+        # 连续的Document合并为一批交给reader
+        nodes = [node]
+        while (len(nodes) < self.reader_batch_size and self.tree.leaf_nodes
+               and self.tree.leaf_nodes.peek().node_type == 'Document'):
+            nodes.append(self.tree.leaf_nodes.pop())
+        return nodes, executor.submit(self._run_task, self._read, nodes)
+
+    def cancel(self):
+        """Stop submitting new work; in-flight tasks still finish and are added to the tree."""
+        self._cancelled.set()
+
+    def _should_stop(self) -> bool:
+        return (self._cancelled.is_set() or self.tree.doc_node_num >= self.max_documents
+                or self.tree.tokens >= self.max_tokens)
+
+    def _crawl(self, on_admit: Optional[Callable[[Document], None]] = None, release: bool = False):
+        logger.info(f"SearchLoader Start Running...")
+        llm_stats = self.llm_cache.stats() if self.llm_cache else {}
+        baseline = metrics.snapshot() if metrics.enabled else None
+        in_flight: Deque[Tuple[List[Node], Future]] = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while self.tree.leaf_nodes or in_flight:
+                    # 达到停止条件后不再提交，超出部分最多为正在执行的节点
+                    while self.tree.leaf_nodes and len(in_flight) < self.max_workers and not self._should_stop():
+                        in_flight.append(self._submit(executor))
+                    if not in_flight:
+                        break
+                    # 按提交顺序回收结果，相同输入下树结构可复现
+                    nodes, future = in_flight.popleft()
+                    for node, dataset in zip(nodes, future.result()):
+                        if dataset is None:
+                            # 触发stop，删除节点
+                            self.tree.delete_node(node)
+                            continue
+                        if isinstance(dataset, Exception):
+                            # reader失败（限流、超时）不标记为已展开，续爬时重试
+                            continue
+                        if self.relevance:
+                            dataset = self._prefilter(dataset)
+                        for data in dataset:
+                            if isinstance(data, Document):
+                                logger.info(f"New Document: source={data.metadata.get('source')} page_content={data.page_content}")
+                            else:
+                                logger.info(f"New Query: {data}")
+                        for child in self.tree.add_nodes(node, dataset=dataset):
+                            if child.node_type != 'Document':
+                                continue
+                            doc = child.data
+                            if self.chunk_writer:
+                                # 边爬取边切分落盘，切分在后台线程进行
+                                self.chunk_writer.add(doc)
+                            if self.indexer:
+                                self.indexer.add(doc)
+                            if on_admit:
+                                on_admit(doc)
+                        self.tree.mark_expanded(node)
+                        if release and node.node_type == 'Document':
+                            # 已输出且已阅读，只保留节点骨架
+                            node.release()
+        finally:
+            # 每次爬取结束都释放文件句柄与后台线程，再次爬取时重新打开
+            if self.indexer:
+                self.indexer.close()
+            if self.chunk_writer:
+                self.chunk_writer.close()
+            self.tree.close()
+        if self.relevance:
+            logger.info(f"Relevance prefilter: {self.relevance.stats()}")
+        if self.indexer:
+            logger.info(f"Vector index: {len(self.indexer.index)} rows, embedding cache: {embedding_cache.stats()}")
+        if self.chunk_writer:
+            logger.info(f"Chunks written: {self.chunk_writer.chunks} -> {self.chunk_writer.chunks_path}")
+        logger.info(f"Duplicate documents: {self.tree.duplicates} Merged queries: {self.tree.merged_queries}")
+        logger.info(f"Fetch cache: {fetch_cache.stats()} Search cache: {search_cache.stats()}")
+        if self.llm_cache:
+            run_stats = {k: v - llm_stats[k] for k, v in self.llm_cache.stats().items() if k != 'hit_rate'}
+            lookups = run_stats['hits'] + run_stats['misses']
+            run_stats['hit_rate'] = run_stats['hits'] / lookups if lookups else 0.0
+            logger.info(f"LLM cache (this run): {run_stats}")
+        if baseline is not None:
+            self.report = metrics.report(baseline)
+            logger.info(f"Run report: {self.report}")
+
+    def load(self) -> List[Document]:
+        self._cancelled.clear()
+        self._crawl()
         return self.tree.all_documents()
 
+    def _start(self, put: Callable, done: object):
+        """Run the crawl on a background thread, passing each admitted document, then an exception if the crawl
+        raised, then done to put."""
 
-def split_large_chunk_and_save(docs: List[Document], max_chunk_size=4000, chunk_size=4000, chunk_overlap=0):
-    splitter = RecursiveCharacterTextSplitter(
-        separators=[
-            "<p", '<h', '\n\n', '\n', '\r', '......', '!', '.', '。', '？', '！', '##'
-        ],
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len
-    )
+        def run():
+            try:
+                self._crawl(on_admit=put, release=self.release_emitted)
+            except BaseException as e:
+                put(e)
+            finally:
+                put(done)
+
+        self._cancelled.clear()
+        threading.Thread(target=run, name='search-loader', daemon=True).start()
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield each document as soon as it is admitted to the tree while the crawl runs in a background thread."""
+        queue: Queue = Queue()
+        done = object()
+        self._start(queue.put, done)
+        try:
+            while (item := queue.get()) is not done:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # 消费方提前退出时停止提交新任务
+            self.cancel()
+
+    async def alazy_load(self) -> AsyncIterator[Document]:
+        """Async lazy_load; the crawl thread feeds an asyncio.Queue, so cancelling the consuming task also cancels
+        the crawl."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # 事件循环已关闭，消费方早已退出
+                pass
 
+        self._start(put, done)
+        try:
+            while (item := await queue.get()) is not done:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.cancel()
 
 if __name__ == '__main__':
     import logging
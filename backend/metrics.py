@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import copy
+import functools
+import threading
+import time
+from typing import Dict, Tuple, Any, Optional, Callable
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+import settings
+
+Labels = Tuple[Tuple[str, Any], ...]
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ('metrics', 'stage', 'labels', 'start', 'otel')
+
+    def __init__(self, metrics: 'Metrics', stage: str, labels: Labels):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+        self.otel = None
+
+    def __enter__(self):
+        if self.metrics.tracer is not None:
+            self.otel = self.metrics.tracer.start_as_current_span(self.stage, attributes=dict(self.labels))
+            self.otel.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start, exc_type is not None, self.labels)
+        if self.otel is not None:
+            self.otel.__exit__(exc_type, exc, tb)
+        return False
+
+
+class Metrics:
+    """Per-stage timings and counters. When disabled every call returns immediately without allocating."""
+
+    def __init__(self, enabled: bool = False, otel: bool = False):
+        self.enabled = enabled
+        self.tracer = None
+        if enabled and otel:
+            from opentelemetry import trace
+            self.tracer = trace.get_tracer('nextsearch')
+        # (stage, labels) -> [count, errors, seconds, max_seconds]
+        self._stages: Dict[Tuple[str, Labels], list] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage: str, **labels):
+        if not self.enabled:
+            return NOOP_SPAN
+        return _Span(self, stage, tuple(sorted(labels.items())))
+
+    def timed(self, stage: str, **labels) -> Callable:
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage: str, seconds: float, error: bool = False, labels: Labels = ()):
+        with self._lock:
+            stats = self._stages.setdefault((stage, labels), [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += error
+            stats[2] += seconds
+            stats[3] = max(stats[3], seconds)
+
+    def incr(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {'stages': copy.deepcopy(self._stages), 'counters': dict(self._counters)}
+
+    def report(self, baseline: Optional[Dict[str, dict]] = None) -> Dict[str, list]:
+        """Stages and counters since baseline (a previous snapshot), as plain dicts."""
+        current = self.snapshot()
+        baseline = baseline or {'stages': {}, 'counters': {}}
+        stages = []
+        for (stage, labels), (count, errors, seconds, max_seconds) in current['stages'].items():
+            old = baseline['stages'].get((stage, labels), [0, 0, 0.0, 0.0])
+            if count - old[0]:
+                stages.append({
+                    'stage': stage, **dict(labels), 'count': count - old[0], 'errors': errors - old[1],
+                    'seconds': seconds - old[2], 'max_seconds': max_seconds,
+                })
+        counters = []
+        for (name, labels), value in current['counters'].items():
+            if value - baseline['counters'].get((name, labels), 0):
+                counters.append({'name': name, **dict(labels), 'value': value - baseline['counters'].get((name, labels), 0)})
+        return {'stages': sorted(stages, key=lambda x: -x['seconds']), 'counters': counters}
+
+    def to_prometheus(self, prefix: str = 'nextsearch') -> str:
+        def fmt(labels: Labels) -> str:
+            return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}' if labels else ''
+
+        current = self.snapshot()
+        lines = []
+        for (stage, labels), (count, errors, seconds, max_seconds) in current['stages'].items():
+            labels = (('stage', stage),) + labels
+            lines.append(f'{prefix}_stage_seconds_sum{fmt(labels)} {seconds}')
+            lines.append(f'{prefix}_stage_seconds_count{fmt(labels)} {count}')
+            lines.append(f'{prefix}_stage_errors_total{fmt(labels)} {errors}')
+        for (name, labels), value in current['counters'].items():
+            lines.append(f'{prefix}_{name}_total{fmt(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Counts LLM prompt/completion tokens per chain."""
+
+    def __init__(self, metrics: Metrics, chain: str):
+        self.metrics = metrics
+        self.chain = chain
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        self.metrics.incr('llm_calls', chain=self.chain)
+        self.metrics.incr('llm_tokens_in', usage.get('prompt_tokens') or 0, chain=self.chain)
+        self.metrics.incr('llm_tokens_out', usage.get('completion_tokens') or 0, chain=self.chain)
+
+
+metrics = Metrics(enabled=settings.METRICS_ENABLED, otel=settings.METRICS_OTEL)
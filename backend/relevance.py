@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+from collections import Counter
+from typing import Dict, Iterable, Literal, Optional
+
+import settings
+from dedup import tokenize
+from documents import Document
+from metrics import metrics
+from scheduler import default_scorer
+
+Action = Literal['prune', 'deprioritize']
+
+
+class BM25:
+    """Okapi BM25 over a corpus that grows one document at a time."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.df: Dict[str, int] = {}
+        self.num_docs = 0
+        self.total_length = 0
+
+    def add(self, counts: Counter, length: int):
+        self.num_docs += 1
+        self.total_length += length
+        for term in counts:
+            self.df[term] = self.df.get(term, 0) + 1
+
+    def idf(self, term: str) -> float:
+        df = self.df.get(term, 0)
+        # Lucene形式，始终为正
+        return math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, terms: Iterable[str], counts: Counter, length: int) -> float:
+        """BM25 of one document divided by the idf mass of the terms seen in the corpus, so 0..1.
+
+        Terms no document has contained yet are left out of the normalization, otherwise a single unseen query word
+        would outweigh every match.
+        """
+        avg_length = self.total_length / self.num_docs if self.num_docs else length or 1
+        norm = self.k1 * (1 - self.b + self.b * length / (avg_length or 1))
+        score = best = 0.0
+        for term in terms:
+            if term not in self.df:
+                continue
+            idf = self.idf(term)
+            best += idf
+            tf = counts.get(term)
+            if tf:
+                # 省略(k1 + 1)因子，单项上限即为idf
+                score += idf * tf / (tf + norm)
+        return score / best if best else 0.0
+
+
+class RelevanceFilter:
+    """Scores documents against the topic and their originating query before they reach the reader.
+
+    Statistics are built from every document seen so far; below ``min_docs`` documents nothing is pruned since
+    the idf weights are not meaningful yet. ``deprioritize`` only reorders the ``best`` frontier policy.
+    """
+
+    def __init__(self, topic: str, threshold: float = None, action: Action = None, min_docs: int = None):
+        self.topic_terms = set(tokenize(topic))
+        self.threshold = settings.RELEVANCE_THRESHOLD if threshold is None else threshold
+        self.action = action or settings.RELEVANCE_ACTION
+        if self.action not in ('prune', 'deprioritize'):
+            raise KeyError('Supported action: prune, deprioritize')
+        self.min_docs = settings.RELEVANCE_MIN_DOCS if min_docs is None else min_docs
+        self.bm25 = BM25()
+        self.pruned = 0
+        self.deprioritized = 0
+
+    def score(self, doc: Document) -> float:
+        """Observe doc, score it, and cache the score on ``doc.relevance``."""
+        metadata = doc.metadata
+        tokens = tokenize(' '.join(filter(None, (metadata.get('title'), doc.page_content))))
+        counts = Counter(tokens)
+        self.bm25.add(counts, len(tokens))
+        terms = self.topic_terms | set(tokenize(metadata.get('query') or ''))
+        doc.relevance = self.bm25.score(terms, counts, len(tokens))
+        return doc.relevance
+
+    def is_relevant(self, doc: Document) -> bool:
+        score = self.score(doc)
+        # 统计量不足时只降权不剪枝
+        relevant = score >= self.threshold or (self.action == 'prune' and self.bm25.num_docs <= self.min_docs)
+        if not relevant:
+            if self.action == 'prune':
+                self.pruned += 1
+            else:
+                self.deprioritized += 1
+            metrics.incr('relevance_filtered', action=self.action)
+        return relevant
+
+    def penalty(self, doc: Document) -> float:
+        """Frontier score penalty for a deprioritized document."""
+        if self.action == 'deprioritize' and doc.relevance is not None and doc.relevance < self.threshold:
+            return settings.RELEVANCE_PENALTY
+        return 0.0
+
+    def stats(self) -> Dict[str, int]:
+        return {'scored': self.bm25.num_docs, 'pruned': self.pruned, 'deprioritized': self.deprioritized}
+
+
+def relevance_scorer(relevance: Optional[RelevanceFilter]):
+    """Frontier scorer that sinks deprioritized documents below everything else."""
+
+    def scorer(node) -> float:
+        score = default_scorer(node)
+        if relevance is not None and node.node_type == 'Document':
+            score -= relevance.penalty(node.data)
+        return score
+    return scorer
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Literal, Tuple, Iterator, Iterable, Dict, Deque, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from documents import Node
+
+Policy = Literal['bfs', 'dfs', 'best']
+
+NEUTRAL_SCORE = 5.0
+DEPTH_PENALTY = 0.5
+COST_PENALTY = 0.5  # 每1000 token
+TYPE_BONUS: Dict[str, float] = {'Query': 0.0, 'web_page': 1.0, 'wiki': 1.5, 'essay': 1.5}
+
+
+def inherited_score(node: 'Node') -> float:
+    """Reader score of the node or of its nearest scored ancestor."""
+    while node is not None:
+        if node.score is not None:
+            return node.score
+        node = node.parent
+    return NEUTRAL_SCORE
+
+
+def default_scorer(node: 'Node') -> float:
+    if node.node_type == 'Document':
+        bonus = TYPE_BONUS.get(node.data.metadata.get('type'), 1.0)
+    else:
+        bonus = TYPE_BONUS['Query']
+    return inherited_score(node) + bonus - DEPTH_PENALTY * node.depth - COST_PENALTY * node.tokens / 1000
+
+
+class Frontier:
+    """Heap-backed frontier of nodes waiting to be expanded.
+
+    ``bfs`` pops the shallowest node first, ``dfs`` the deepest, ``best`` the highest ``scorer`` value.
+    Ties go to the most recently pushed node.
+    """
+
+    def __init__(self, policy: Policy = 'best', scorer: Callable[['Node'], float] = default_scorer):
+        if policy not in ('bfs', 'dfs', 'best'):
+            raise KeyError('Supported policy: bfs, dfs, best')
+        self.policy = policy
+        self.scorer = scorer
+        self._heap: List[Tuple[float, int, 'Node']] = []
+        self._counter = itertools.count()
+
+    def _key(self, node: 'Node') -> float:
+        if self.policy == 'bfs':
+            return node.depth
+        elif self.policy == 'dfs':
+            return -node.depth
+        return -self.scorer(node)
+
+    def push(self, node: 'Node'):
+        heapq.heappush(self._heap, (self._key(node), -next(self._counter), node))
+
+    def extend(self, nodes: Iterable['Node']):
+        for node in nodes:
+            self.push(node)
+
+    def pop(self) -> 'Node':
+        return heapq.heappop(self._heap)[-1]
+
+    def peek(self) -> 'Node':
+        return self._heap[0][-1]
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __iter__(self) -> Iterator['Node']:
+        return (item[-1] for item in sorted(self._heap))
+
+
+class FairBudget:
+    """Global cap on in-flight tasks shared by many crawls; free slots go round-robin across jobs with waiters."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiting: 'OrderedDict[str, Deque[object]]' = OrderedDict()
+        self._cond = threading.Condition()
+
+    def _next(self):
+        for tickets in self._waiting.values():
+            return tickets[0]
+
+    def acquire(self, job: str):
+        ticket = object()
+        with self._cond:
+            self._waiting.setdefault(job, deque()).append(ticket)
+            while self.in_flight >= self.limit or self._next() is not ticket:
+                self._cond.wait()
+            tickets = self._waiting.pop(job)
+            tickets.popleft()
+            if tickets:
+                # 该任务还有等待者，排到队尾实现轮转
+                self._waiting[job] = tickets
+            self.in_flight += 1
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class TimedTask:
+    """fn submitted to a shared executor whose timeout counts from when a worker starts it, so time spent queued
+    behind other loaders' work does not count against it."""
+
+    def __init__(self, executor: Executor, fn: Callable, *args):
+        self.started_at: Optional[float] = None
+        self._started = threading.Event()
+        self.future: Future = executor.submit(self._run, fn, *args)
+
+    def _run(self, fn: Callable, *args):
+        self.started_at = time.monotonic()
+        self._started.set()
+        return fn(*args)
+
+    def result(self, timeout: float):
+        """fn's result; raises TimeoutError once fn has been running for timeout seconds."""
+        self._started.wait()
+        try:
+            return self.future.result(timeout=max(self.started_at + timeout - time.monotonic(), 0))
+        except FutureTimeoutError:
+            # 超时后无法中断仍在运行的线程，只放弃等待
+            self.future.cancel()
+            raise
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Long-lived crawl service: many topics crawl concurrently in one process and share the fetch/search/LLM caches,
+HTTP pools, rate limiters and a global in-flight budget.
+
+Run from backend/:
+    python server.py --host 127.0.0.1 --port 8000
+
+    POST   /crawls                     {"topic": str, "config": {...}}  -> job
+    GET    /crawls                     -> [job]
+    GET    /crawls/{id}                -> job
+    GET    /crawls/{id}/documents      ?offset=N&limit=M -> {"documents": [...], "next_offset": int}
+    GET    /crawls/{id}/stream         ?offset=N -> NDJSON, one document per line until the job ends
+    DELETE /crawls/{id}                cancel the job
+    GET    /metrics                    Prometheus text
+
+Only HTTP_CONFIG_KEYS are accepted in "config"; ``"checkpoint"``, ``"chunks"`` and ``"index"`` set to true put those
+outputs under ``DATA_DIR/<job id>/``. Browsers are only let in from SERVER_CORS_ORIGINS.
+
+Emitted documents are spilled to ``DATA_DIR/<job id>/documents.jsonl`` rather than kept in memory, a finished job
+drops its SearchLoader, and finished jobs are forgotten after SERVICE_JOB_TTL or beyond SERVICE_MAX_FINISHED_JOBS.
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, List, Literal, Optional, Iterable
+from urllib.parse import urlparse, parse_qs
+
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseLanguageModel
+from langchain_openai import ChatOpenAI
+
+import settings
+from cache import llm_cache
+from main import SearchLoader, ConfigDict
+from metrics import metrics
+from scheduler import FairBudget
+
+logger = logging.getLogger(__name__)
+
+JobStatus = Literal['pending', 'running', 'done', 'cancelled', 'failed']
+# HTTP请求可设置的配置项；文件路径只由服务端生成
+HTTP_CONFIG_KEYS = frozenset({
+    'max_documents', 'max_tokens', 'embedding_model', 'num_results', 'reader_prompt', 'searcher_prompt',
+    'search_engine', 'openai_api_key', 'frontier_policy', 'reader_batch_size', 'reader_pack_tokens',
+    'reader_max_concurrency', 'llm_cache', 'chunk_tokens', 'chunk_overlap', 'relevance_threshold',
+    'relevance_action', 'reader_input_tokens',
+})
+# 为真时在 DATA_DIR/<job id>/ 下生成对应文件
+HTTP_OUTPUT_KEYS = {'checkpoint': 'checkpoint_path', 'chunks': 'chunk_path', 'index': 'index_path'}
+OUTPUT_FILES = {'checkpoint_path': 'checkpoint.jsonl', 'chunk_path': 'chunks', 'index_path': 'vectors'}
+
+
+def serialize(doc: Document) -> dict:
+    return {'page_content': doc.page_content, 'metadata': doc.metadata}
+
+
+class CrawlJob:
+    def __init__(self, topic: str, config: ConfigDict):
+        self.id = uuid.uuid4().hex[:12]
+        self.dir = Path(settings.DATA_DIR) / self.id
+        self.documents_path = self.dir / 'documents.jsonl'
+        self.topic = topic
+        self.config = config
+        self.status: JobStatus = 'pending'
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.loader: Optional[SearchLoader] = None
+        # 结束后保留的统计，loader随即释放
+        self.stats = {'tokens': 0, 'duplicates': 0, 'merged_queries': 0}
+        # 文档写入documents.jsonl，内存中只记每篇的起始字节
+        self._offsets: List[int] = []
+        self._size = 0
+        self._file = None
+        self._discarded = False
+        self._cancelled = False
+        self._cond = threading.Condition()
+
+    @property
+    def num_documents(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'cancelled', 'failed')
+
+    def run(self, loader: SearchLoader):
+        with self._cond:
+            if self._cancelled:
+                self._finish('cancelled')
+                return
+            self.loader = loader
+            self.status = 'running'
+        try:
+            for doc in loader.lazy_load():
+                if self._cancelled:
+                    # 关闭生成器即停止提交新任务
+                    break
+                self._append(doc)
+        except Exception as e:
+            logger.exception(f"Crawl {self.id} failed")
+            self.fail(e)
+            return
+        with self._cond:
+            self._finish('cancelled' if self._cancelled else 'done')
+
+    def _append(self, doc: Document):
+        line = json.dumps(serialize(doc), ensure_ascii=False).encode('utf-8') + b'\n'
+        with self._cond:
+            if self._file is None:
+                self.dir.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.documents_path, 'ab')
+            self._file.write(line)
+            self._file.flush()
+            self._offsets.append(self._size)
+            self._size += len(line)
+            self._cond.notify_all()
+
+    def fail(self, error: BaseException):
+        with self._cond:
+            self.error = repr(error)
+            self._finish('failed')
+
+    def _finish(self, status: JobStatus):
+        if self.loader is not None:
+            tree = self.loader.tree
+            self.stats = {'tokens': tree.tokens, 'duplicates': tree.duplicates, 'merged_queries': tree.merged_queries}
+            self.loader = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.status = status
+        self.finished_at = time.time()
+        self._cond.notify_all()
+
+    def discard(self):
+        """Delete the spilled documents; called when the service forgets the job."""
+        with self._cond:
+            self._discarded = True
+            self.documents_path.unlink(missing_ok=True)
+        try:
+            # 目录中还有checkpoint等输出时保留
+            self.dir.rmdir()
+        except OSError:
+            pass
+
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            if self.loader:
+                self.loader.cancel()
+
+    def documents(self, offset: int, limit: int = None) -> List[dict]:
+        """Up to limit documents starting at offset, read back from documents.jsonl."""
+        limit = limit or settings.SERVICE_PAGE_SIZE
+        with self._cond:
+            if self._discarded or offset >= len(self._offsets):
+                return []
+            start = self._offsets[max(offset, 0)]
+            end = self._offsets[offset + limit] if offset + limit < len(self._offsets) else self._size
+        with open(self.documents_path, 'rb') as f:
+            f.seek(start)
+            return [json.loads(line) for line in f.read(end - start).splitlines()]
+
+    def wait(self, offset: int, timeout: float) -> List[dict]:
+        """Block until there are documents past offset or the job has ended."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._offsets) > offset or self.finished, timeout)
+        return self.documents(offset)
+
+    def to_dict(self) -> dict:
+        loader = self.loader
+        stats = {
+            'tokens': loader.tree.tokens, 'duplicates': loader.tree.duplicates,
+            'merged_queries': loader.tree.merged_queries
+        } if loader else self.stats
+        return {
+            'id': self.id, 'topic': self.topic, 'status': self.status, 'error': self.error,
+            'created_at': self.created_at, 'finished_at': self.finished_at,
+            'documents': self.num_documents, **stats,
+        }
+
+
+class CrawlService:
+    """Owns the jobs; every loader draws from one FairBudget so a large crawl cannot starve the others."""
+
+    def __init__(self, max_jobs: int = None, max_in_flight: int = None):
+        self.budget = FairBudget(max_in_flight or settings.SERVICE_MAX_IN_FLIGHT)
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs or settings.SERVICE_MAX_JOBS,
+                                           thread_name_prefix='crawl-job')
+        self.jobs: Dict[str, CrawlJob] = {}
+        self._llms: Dict[Optional[str], BaseLanguageModel] = {}
+        self._lock = threading.Lock()
+
+    def _llm(self, config: ConfigDict) -> Optional[BaseLanguageModel]:
+        if 'llm_cache' in config:
+            # 自定义缓存模式由SearchLoader自行创建客户端
+            return None
+        api_key = config.get('openai_api_key')
+        with self._lock:
+            if api_key not in self._llms:
+                self._llms[api_key] = ChatOpenAI(openai_api_key=api_key, cache=llm_cache)
+            return self._llms[api_key]
+
+    def submit(self, topic: str, config: Optional[ConfigDict] = None, outputs: Iterable[str] = ()) -> CrawlJob:
+        """Start a crawl; ``outputs`` names the ConfigDict path keys to place under ``DATA_DIR/<job id>/``."""
+        job = CrawlJob(topic, dict(config or {}))
+        if outputs:
+            job.dir.mkdir(parents=True, exist_ok=True)
+            for key in outputs:
+                job.config[key] = str(job.dir / OUTPUT_FILES[key])
+        self.prune()
+        with self._lock:
+            self.jobs[job.id] = job
+
+        def run():
+            try:
+                loader = SearchLoader(topic, config=job.config, llm=self._llm(job.config),
+                                      budget=self.budget, job_id=job.id)
+            except Exception as e:
+                logger.exception(f"Crawl {job.id} failed to start")
+                job.fail(e)
+                return
+            job.run(loader)
+
+        self.executor.submit(run)
+        return job
+
+    def prune(self):
+        """Forget finished jobs older than SERVICE_JOB_TTL and all but the newest SERVICE_MAX_FINISHED_JOBS."""
+        expire = time.time() - settings.SERVICE_JOB_TTL
+        with self._lock:
+            finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.finished_at)
+            excess = len(finished) - settings.SERVICE_MAX_FINISHED_JOBS
+            removed = [job for i, job in enumerate(finished) if i < excess or job.finished_at < expire]
+            for job in removed:
+                del self.jobs[job.id]
+        for job in removed:
+            job.discard()
+
+    def get(self, job_id: str) -> Optional[CrawlJob]:
+        self.prune()
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[CrawlJob]:
+        self.prune()
+        return list(self.jobs.values())
+
+    def shutdown(self):
+        for job in self.list():
+            job.cancel()
+        self.executor.shutdown(wait=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    service: CrawlService
+    stream_poll = 15.0
+
+    def _send_json(self, data, status: HTTPStatus = HTTPStatus.OK):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self._send_cors()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _origin_allowed(self) -> bool:
+        # 非浏览器客户端不带Origin
+        origin = self.headers.get('Origin')
+        return origin is None or origin in settings.SERVER_CORS_ORIGINS
+
+    def _send_cors(self):
+        origin = self.headers.get('Origin')
+        if origin and origin in settings.SERVER_CORS_ORIGINS:
+            self.send_header('Access-Control-Allow-Origin', origin)
+            self.send_header('Vary', 'Origin')
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
+            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+
+    def _error(self, status: HTTPStatus, message: str):
+        self._send_json({'error': message}, status)
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        return parts, parse_qs(url.query)
+
+    def _job(self, parts: List[str]) -> Optional[CrawlJob]:
+        job = self.service.get(parts[1])
+        if job is None:
+            self._error(HTTPStatus.NOT_FOUND, f'no crawl {parts[1]}')
+        return job
+
+    def do_OPTIONS(self):
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self._send_cors()
+        self.end_headers()
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts != ['crawls']:
+            return self._error(HTTPStatus.NOT_FOUND, self.path)
+        if not self._origin_allowed():
+            return self._error(HTTPStatus.FORBIDDEN, 'origin not allowed')
+        # 要求JSON以触发浏览器预检，其他网页无法用简单请求提交
+        if (self.headers.get('Content-Type') or '').split(';')[0].strip() != 'application/json':
+            return self._error(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, 'Content-Type must be application/json')
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._error(HTTPStatus.BAD_REQUEST, 'invalid JSON body')
+        topic = body.get('topic')
+        if not isinstance(topic, str) or not topic.strip():
+            return self._error(HTTPStatus.BAD_REQUEST, 'topic is required')
+        config = body.get('config') or {}
+        if not isinstance(config, dict):
+            return self._error(HTTPStatus.BAD_REQUEST, 'config must be an object')
+        unknown = set(config) - HTTP_CONFIG_KEYS - set(HTTP_OUTPUT_KEYS)
+        if unknown:
+            return self._error(HTTPStatus.BAD_REQUEST, f'unsupported config keys: {sorted(unknown)}')
+        outputs = [path_key for key, path_key in HTTP_OUTPUT_KEYS.items() if config.get(key)]
+        config = {k: v for k, v in config.items() if k in HTTP_CONFIG_KEYS}
+        job = self.service.submit(topic, config, outputs)
+        self._send_json(job.to_dict(), HTTPStatus.CREATED)
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != 'crawls':
+            return self._error(HTTPStatus.NOT_FOUND, self.path)
+        if not self._origin_allowed():
+            return self._error(HTTPStatus.FORBIDDEN, 'origin not allowed')
+        if job := self._job(parts):
+            job.cancel()
+            self._send_json(job.to_dict())
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['metrics']:
+            body = metrics.to_prometheus().encode('utf-8')
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif parts == ['crawls']:
+            self._send_json([job.to_dict() for job in self.service.list()])
+        elif len(parts) >= 2 and parts[0] == 'crawls':
+            if not (job := self._job(parts)):
+                return
+            try:
+                offset = max(int(query.get('offset', ['0'])[0]), 0)
+                limit = min(int(query.get('limit', [settings.SERVICE_PAGE_SIZE])[0]), settings.SERVICE_PAGE_SIZE)
+            except ValueError:
+                return self._error(HTTPStatus.BAD_REQUEST, 'offset and limit must be integers')
+            if len(parts) == 2:
+                self._send_json(job.to_dict())
+            elif parts[2:] == ['documents']:
+                documents = job.documents(offset, max(limit, 1))
+                self._send_json({'documents': documents, 'next_offset': offset + len(documents)})
+            elif parts[2:] == ['stream']:
+                self._stream(job, offset)
+            else:
+                self._error(HTTPStatus.NOT_FOUND, self.path)
+        else:
+            self._error(HTTPStatus.NOT_FOUND, self.path)
+
+    def _stream(self, job: CrawlJob, offset: int):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self._send_cors()
+        self.end_headers()
+        try:
+            while True:
+                documents = job.wait(offset, self.stream_poll)
+                for doc in documents:
+                    self.wfile.write(json.dumps(doc, ensure_ascii=False).encode('utf-8') + b'\n')
+                offset += len(documents)
+                if not documents and job.finished:
+                    break
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端断开不影响爬取任务
+            pass
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def serve(host: str = None, port: int = None, service: Optional[CrawlService] = None):
+    service = service or CrawlService()
+    handler = type('CrawlHandler', (Handler,), {'service': service})
+    server = ThreadingHTTPServer((host or settings.SERVER_HOST, port or settings.SERVER_PORT), handler)
+    server.daemon_threads = True
+    logger.info(f"Crawl service listening on {server.server_address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=settings.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=settings.SERVER_PORT)
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -19,6 +19,68 @@ READER_PROMPT = (
 DEFAULT_SEARCH_ENGINE = 'duckduckgo'
 PAGE_CONTENT_KEYS = ['summary', 'title', 'query', 'keywords', 'content']
 MAX_CHUNK_SIZE = 4000
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP = 64
+RELEVANCE_THRESHOLD = 0.1  # 0 关闭预筛选
+RELEVANCE_ACTION = 'deprioritize'  # 'prune' / 'deprioritize'
+RELEVANCE_MIN_DOCS = 20
+RELEVANCE_PENALTY = 10.0
 NUM_RESULTS = 5
+MAX_WORKERS = 4
+FRONTIER_POLICY = 'best'
+READER_BATCH_SIZE = 4
+READER_PACK_TOKENS = 1500
+READER_MAX_CONCURRENCY = 4
+READER_INPUT_TOKENS = 1000  # 单次阅读输入的token预算，0 关闭压缩
 DATA_DIR = Path('./')
+FETCH_TIMEOUT = (5, 15)  # (connect, read)
+FETCH_DEADLINE = 30
+FETCH_MAX_PER_HOST = 2
+FETCH_POOL_SIZE = 16
+FETCH_WORKERS = 16
+FETCH_CACHE_FILE = 'fetch_cache.sqlite3'
+FETCH_CACHE_TTL = 7 * 24 * 3600
+FETCH_CACHE_MAX_BYTES = 1024 ** 3
+SEARCH_CACHE_TTL = 6 * 3600
+SEARCH_CACHE_MAX_SIZE = 4096
+TOOL_WORKERS = 16
+TOOL_TIMEOUT = 60
+TOOL_TIMEOUTS = {'search_with_arxiv': 120}
+LLM_CACHE = 'exact'  # None / 'exact' / 'semantic'
+LLM_CACHE_FILE = 'llm_cache.sqlite3'
+LLM_CACHE_MAX_ENTRIES = 100000
+LLM_CACHE_SIMILARITY = 0.97
+EMBEDDING_CACHE_FILE = 'embedding_cache.sqlite3'
+EMBED_BATCH_SIZE = 64
+VECTOR_INDEX_NPROBE = 8
+VECTOR_INDEX_IVF_MIN = 4096  # 少于该行数时精确检索
+MAX_HTML_BYTES = 5 * 1024 ** 2
+PARSE_WORKERS = 0  # >0 时在进程池中解析HTML
+PDF_MAX_CHARS = 100000
+PDF_MAX_BYTES = 50 * 1024 ** 2
+PDF_PARALLEL_PAGES = 64
+PDF_PAGES_PER_TASK = 16
+PDF_WORKERS = 4
+SEARCH_RATE = 1.0  # 每秒请求数，按AIMD自适应
+SEARCH_RATE_MAX = 5.0
+SEARCH_RATE_LIMITS = {'DuckDuckGoAPI': 0.5}
+SEARCH_RETRIES = 3
+SEARCH_FALLBACK_ENGINES = {}  # 例如 {'duckduckgo': ['searx', 'brave']}
+FETCH_HOST_RATE = 2.0
+FETCH_HOST_RATE_MAX = 10.0
+FETCH_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN = 60
+METRICS_ENABLED = False
+METRICS_OTEL = False
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8000
+SERVER_CORS_ORIGINS = ('http://localhost:3000', 'http://127.0.0.1:3000')  # 前端Next.js地址
+SERVICE_MAX_JOBS = 8  # 同时运行的爬取任务数
+SERVICE_MAX_IN_FLIGHT = 16  # 所有任务共享的搜索/阅读并发上限
+SERVICE_JOB_TTL = 24 * 3600  # 已结束任务的保留秒数
+SERVICE_MAX_FINISHED_JOBS = 100  # 最多保留的已结束任务数
+SERVICE_PAGE_SIZE = 500  # 单次返回的文档数上限
 TOOL_PROXY = 'http://127.0.0.1:7890'
\ No newline at end of file
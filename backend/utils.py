@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import locale
+import re
+import unicodedata
 from typing import Sequence
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 import pycountry
 
@@ -12,6 +15,34 @@ def get_list(data):
     return data
 
 
+# 只去除广告/营销平台的点击追踪参数；ref、from等通用名称可能是页面真正使用的参数
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'yclid', 'msclkid', 'igshid', 'mc_cid', 'mc_eid',
+                   '_hsenc', '_hsmi', 'mkt_tok'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of url: lowercase scheme/host, no default port, fragment or tracking params, sorted query.
+    The host is otherwise kept as given, since www.example.com and example.com may serve different sites."""
+    parts = urlsplit(str(url).strip())
+    scheme = parts.scheme.lower() or 'http'
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    path = parts.path.rstrip('/') or '/'
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+def normalize_query(query: str) -> str:
+    """Case, width, punctuation and whitespace insensitive form of a search query."""
+    query = unicodedata.normalize('NFKC', query).lower()
+    return ' '.join(re.sub(r'[^\w\s]+', ' ', query).split())
+
+
 def get_os_language():
     try:
         return pycountry.languages.get(alpha_2=locale.getdefaultlocale()[0].split('_')[0]).name
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Embedding stage and a local approximate nearest neighbour index over crawled documents.
+
+The index lives in two files next to ``path``::
+
+    <name>.f32            raw float32 rows, unit-normalized, memory-mapped for search
+    <name>.records.jsonl  one {"key", "source", "title", "text"} per row, in the same order
+
+Small indexes are searched exhaustively; past ``VECTOR_INDEX_IVF_MIN`` rows an IVF (k-means coarse quantizer) is
+trained in memory and only the ``nprobe`` closest lists are scanned.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import List, Optional, Dict, Tuple, Union, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import settings
+from cache import embedding_cache, EmbeddingCache
+from documents import Document
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from the embedding cache and batches the rest."""
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: Optional[EmbeddingCache] = None,
+                 batch_size: int = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache or embedding_cache
+        self.batch_size = batch_size or settings.EMBED_BATCH_SIZE
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.key(self.model, text) for text in texts]
+        found = self.cache.get_many(keys)
+        # 同一批内重复的文本只请求一次
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        if missing:
+            text_of = dict(zip(keys, texts))
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                with metrics.span('embed', model=self.model):
+                    vectors = self.embeddings.embed_documents([text_of[k] for k in batch])
+                new = {k: np.asarray(v, dtype=np.float32) for k, v in zip(batch, vectors)}
+                self.cache.put_many(new)
+                found.update(new)
+        return [found[k].tolist() for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors; returns k unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        for i in range(k):
+            members = data[assign == i]
+            # 空簇重新随机取点
+            centroids[i] = members.sum(axis=0) if len(members) else data[rng.integers(len(data))]
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class VectorIndex:
+    """Append-only cosine index keyed by content hash; re-adding a key is a no-op."""
+
+    def __init__(self, path: Union[str, Path], nprobe: int = None, ivf_min: int = None):
+        path = Path(path)
+        self.vectors_path = path.with_suffix('.f32')
+        self.records_path = path.with_suffix('.records.jsonl')
+        self.nprobe = nprobe or settings.VECTOR_INDEX_NPROBE
+        self.ivf_min = ivf_min or settings.VECTOR_INDEX_IVF_MIN
+        self.records: List[dict] = []
+        self.keys: Dict[str, int] = {}
+        self.dim: Optional[int] = None
+        self._matrix: Optional[np.memmap] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._trained = 0
+        self._assigned = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.records_path.exists():
+            with open(self.records_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 中断写入的最后一行
+                        break
+                    self.keys[record['key']] = len(self.records)
+                    self.records.append(record)
+        if self.records and self.vectors_path.exists():
+            self.dim = self.records[0]['dim']
+            rows = self.vectors_path.stat().st_size // (4 * self.dim)
+            if rows < len(self.records):
+                # 向量先于记录写入，行数少说明文件损坏，只保留对齐的部分
+                for record in self.records[rows:]:
+                    del self.keys[record['key']]
+                self.records = self.records[:rows]
+            elif rows > len(self.records):
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(len(self.records) * 4 * self.dim)
+        else:
+            self.records, self.keys = [], {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def add(self, keys: Sequence[str], vectors: np.ndarray, records: Sequence[dict]) -> int:
+        """Append the rows whose key is new; returns how many were added."""
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(keys), -1))
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f'Vector dim {vectors.shape[1]} does not match index dim {self.dim}')
+            rows = [i for i, key in enumerate(keys) if key not in self.keys]
+            rows = list({keys[i]: i for i in rows}.values())
+            if not rows:
+                return 0
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors[rows].tobytes())
+            with open(self.records_path, 'a', encoding='utf-8') as f:
+                for i in rows:
+                    record = {**records[i], 'key': keys[i], 'dim': self.dim}
+                    self.keys[keys[i]] = len(self.records)
+                    self.records.append(record)
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._matrix = None
+        return len(rows)
+
+    def _vectors(self) -> np.ndarray:
+        if self._matrix is None or len(self._matrix) != len(self.records):
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.records), self.dim))
+        return self._matrix
+
+    def _assign(self, matrix: np.ndarray, start: int):
+        # 分块计算，避免整表载入内存
+        for block in range(start, len(matrix), 65536):
+            assign = np.argmax(np.asarray(matrix[block:block + 65536]) @ self._centroids.T, axis=1)
+            for offset, cluster in enumerate(assign):
+                self._lists[cluster].append(block + offset)
+        self._assigned = len(matrix)
+
+    def _ensure_ivf(self, matrix: np.ndarray):
+        n = len(matrix)
+        if self._centroids is None or n > 2 * self._trained:
+            nlist = max(1, int(np.sqrt(n)))
+            rng = np.random.default_rng(0)
+            sample = np.asarray(matrix[np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))])
+            with metrics.span('ivf_train', rows=n):
+                self._centroids = kmeans(sample, nlist)
+            self._lists = [[] for _ in range(nlist)]
+            self._trained = n
+            self._assign(matrix, 0)
+        elif n > self._assigned:
+            # 新增向量分配到已有簇，数量翻倍后再重新训练
+            self._assign(matrix, self._assigned)
+
+    def search(self, vector: Sequence[float], k: int = 4) -> List[Tuple[float, dict]]:
+        """Return up to k (cosine similarity, record) pairs, most similar first."""
+        with self._lock:
+            if not self.records:
+                return []
+            matrix = self._vectors()
+            query = _normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+            if len(matrix) < self.ivf_min:
+                candidates = None
+                scores = np.asarray(matrix) @ query
+            else:
+                self._ensure_ivf(matrix)
+                probes = np.argsort(self._centroids @ query)[::-1][:self.nprobe]
+                candidates = np.fromiter(
+                    (i for p in probes for i in self._lists[p]), dtype=np.int64
+                )
+                candidates.sort()
+                scores = np.asarray(matrix[candidates]) @ query
+            k = min(k, len(scores))
+            if not k:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = candidates[top] if candidates is not None else top
+            return [(float(scores[t]), self.records[r]) for t, r in zip(top, rows)]
+
+
+class DocumentIndexer:
+    """Embeds admitted documents in batches on a background thread and appends them to a VectorIndex."""
+
+    def __init__(self, index: VectorIndex, embeddings: CachedEmbeddings, batch_size: int = None):
+        self.index = index
+        self.embeddings = embeddings
+        self.batch_size = batch_size or settings.EMBED_BATCH_SIZE
+        self._pending: List[Document] = []
+        # 单线程保证写入顺序，也不阻塞爬取主循环；close后再次提交时重新创建
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures: List[Future] = []
+
+    def key(self, doc: Document) -> str:
+        return EmbeddingCache.key(self.embeddings.model, doc.page_content)
+
+    def add(self, doc: Document):
+        self._pending.append(doc)
+        if len(self._pending) >= self.batch_size:
+            self._submit()
+
+    def _submit(self):
+        batch, self._pending = self._pending, []
+        if batch:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='indexer')
+            self._futures.append(self._executor.submit(self._index, batch))
+
+    def _index(self, batch: List[Document]):
+        batch = [doc for doc in batch if self.key(doc) not in self.index]
+        if not batch:
+            return
+        vectors = self.embeddings.embed_documents([doc.page_content for doc in batch])
+        self.index.add(
+            [self.key(doc) for doc in batch], np.asarray(vectors, dtype=np.float32),
+            [{'source': doc.metadata.get('source'), 'title': doc.metadata.get('title'), 'text': doc.page_content}
+             for doc in batch]
+        )
+
+    def flush(self):
+        """Index what is buffered and wait for every batch; a failed batch is logged, not raised."""
+        self._submit()
+        futures, self._futures = self._futures, []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"Embedding batch failed: {e!r}")
+
+    def close(self):
+        """Flush, then stop the background thread."""
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Tuple[float, dict]]:
+        return self.index.search(self.embeddings.embed_query(query), k)